@@ -1,15 +1,17 @@
 from pathlib import Path
 
 from litestar import Litestar, Request, get
-from litestar.contrib.jinja import JinjaTemplateEngine
-from litestar.response import Redirect, Template
-from litestar.static_files import create_static_files_router
-from litestar.template.config import TemplateConfig
+from litestar.response import Redirect, Response
 
-from modules.discord_bot import bot_start_lifespan
+from modules.assets import Pages, StaticAssets, static_router
+from modules.local import LOCAL_MODE, local_router
+from modules.store import EXTERNAL_BOT, WORKER, create_party_store
 from modules.types import Party
 from modules.buzzer import buzzer_router
 from modules.host import host_router
+from modules.watch import watch_router
+from modules.ipc import ipc_router
+from modules.metrics import serve_metrics
 
 
 @get("/favicon.ico")
@@ -18,30 +20,59 @@ async def favicon() -> None:
 
 
 @get("/")
-async def index(request: Request) -> Template | Redirect:
+async def index(request: Request) -> Response | Redirect:
     party_id = request.cookies.get("party")
     user_id = request.cookies.get("user")
     if party_id and user_id:
         party: Party = app.state.parties.get(party_id)
         if party and user_id in party.lost_connections:
-            print(party.lost_connections)
             return Redirect(f"/buzzer/{party.id}")
-    return Template("index.html")
+    return request.app.state.pages.response(request, "index.html")
 
 
+def start_party_store(app: Litestar) -> None:
+    app.state.parties.start()
+
+
+@get("/ready", include_in_schema=False)
+async def ready(request: Request) -> Response:
+    # The site serves before the bot is connected, this tells them apart.
+    bot = request.app.state.bot_ready()
+    return Response({"web": True, "bot": bot}, status_code=200 if bot else 503)
+
+
+async def close_party_store(app: Litestar) -> None:
+    await app.state.parties.close()
+
+
+# Only one worker may run the bot, it reaches the others through the store.
+lifespan = []
+if WORKER == 0 and not EXTERNAL_BOT and not LOCAL_MODE:
+    from modules.discord_bot import bot_start_lifespan
+
+    lifespan.append(bot_start_lifespan)
+
 app = Litestar(
     route_handlers=[
         index,
         favicon,
+        ready,
+        serve_metrics,
         buzzer_router,
         host_router,
-        create_static_files_router(path="static", directories=[Path("static")]),
+        watch_router,
+        ipc_router,
+        *([local_router] if LOCAL_MODE else []),
+        static_router,
     ],
-    lifespan=[bot_start_lifespan],
-    template_config=TemplateConfig(
-        directory=Path("templates"),
-        engine=JinjaTemplateEngine,
-    ),
+    lifespan=lifespan,
+    on_startup=[start_party_store],
+    on_shutdown=[close_party_store],
     openapi_config=None,
 )
-app.state.parties = {}
+app.state.parties = create_party_store(app)
+# Hashed, compressed and kept in memory from the start.
+app.state.static = StaticAssets(Path("static"))
+app.state.pages = Pages(Path("templates"), app.state.static)
+# Replaced by the bot's own check when it runs in this process.
+app.state.bot_ready = lambda: True
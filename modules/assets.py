@@ -0,0 +1,174 @@
+"""Static files and pages, prepared once at startup.
+
+Every file in ``static/`` is read into memory, gets a name with a hash of its
+content (``buzz.3f2a9c1b.js``) and is compressed with gzip, and brotli if the
+``brotli`` package is installed. References between the files (``./roster.js``
+imports, ``/static/buzz.wav``) are rewritten to the hashed names, so a hashed
+URL never changes its content and is cached by the browsers for good. The
+plain names still work, but have to be revalidated.
+
+The pages get the same treatment: templates only depend on a handful of fixed
+values, so each variant is rendered and compressed the first time it is asked
+for, and served from memory after that. Changes to either directory need a
+restart.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import re
+from functools import cache
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader
+from litestar import Request, Router, get
+from litestar.datastructures import Cookie
+from litestar.exceptions import NotFoundException
+from litestar.response import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Quoted references to other assets in JS/CSS/HTML.
+REFERENCE = re.compile(r"""(["'(])(\./|/static/)([\w.-]+)(["')])""")
+TEXT_SUFFIXES = {".js", ".css", ".html"}
+
+mimetypes.add_type("text/javascript", ".js")
+
+
+def accepted_encodings(header: str) -> set[str]:
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        params = params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            continue
+        if quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class Asset:
+    """A file with its precompressed variants."""
+
+    def __init__(self, data: bytes, media_type: str) -> None:
+        self.data = data
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        self.variants: dict[str, bytes] = {}
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            self.variants["gzip"] = compressed
+        if brotli:
+            compressed = brotli.compress(data, quality=11)
+            if len(compressed) < len(data):
+                self.variants["br"] = compressed
+
+    def response(
+        self,
+        request: Request,
+        cache_control: str,
+        cookies: list[Cookie] | None = None,
+    ) -> Response:
+        headers = {
+            "Cache-Control": cache_control,
+            "ETag": self.etag,
+            "Vary": "Accept-Encoding",
+        }
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(b"", status_code=304, headers=headers, cookies=cookies)
+
+        body = self.data
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                body = self.variants[encoding]
+                headers["Content-Encoding"] = encoding
+                break
+        return Response(
+            body, media_type=self.media_type, headers=headers, cookies=cookies
+        )
+
+
+class StaticAssets:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        # Hashed name of every file by its plain name.
+        self.names: dict[str, str] = {}
+        self.assets: dict[str, Asset] = {}
+        for path in sorted(directory.iterdir()):
+            if path.is_file():
+                self.load(path.name, set())
+
+    def load(self, name: str, loading: set[str]) -> str:
+        """Prepares a file and the ones it references, returns its hashed name."""
+        if name in self.names:
+            return self.names[name]
+        path = self.directory / name
+        data = path.read_bytes()
+        if path.suffix in TEXT_SUFFIXES:
+            loading.add(name)
+
+            def rewrite(match: re.Match) -> str:
+                quote, prefix, target, end = match.groups()
+                if target in loading or not (self.directory / target).is_file():
+                    return match.group(0)
+                return quote + prefix + self.load(target, loading) + end
+
+            data = REFERENCE.sub(rewrite, data.decode()).encode()
+            loading.discard(name)
+
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        hashed = f"{path.stem}.{digest}{path.suffix}"
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        asset = Asset(data, media_type)
+        self.assets[name] = self.assets[hashed] = asset
+        self.names[name] = hashed
+        return hashed
+
+    def url(self, name: str) -> str:
+        return f"/static/{self.names.get(name, name)}"
+
+    def response(self, request: Request, name: str) -> Response:
+        asset = self.assets.get(name)
+        if not asset:
+            raise NotFoundException()
+        hashed = name not in self.names
+        return asset.response(request, IMMUTABLE if hashed else REVALIDATE)
+
+
+class Pages:
+    def __init__(self, directory: Path, static: StaticAssets) -> None:
+        self.env = Environment(loader=FileSystemLoader(directory), autoescape=True)
+        self.env.globals["asset"] = static.url
+        self.render = cache(self._render)
+
+    def _render(self, name: str, **context) -> Asset:
+        html = self.env.get_template(name).render(**context)
+        return Asset(html.encode(), "text/html; charset=utf-8")
+
+    def response(
+        self,
+        request: Request,
+        name: str,
+        cookies: list[Cookie] | None = None,
+        **context,
+    ) -> Response:
+        """Serves a page, ``context`` must only hold a few distinct values."""
+        page = self.render(name, **context)
+        return page.response(request, REVALIDATE, cookies=cookies)
+
+
+@get("/{name:str}", include_in_schema=False)
+async def serve_static(request: Request, name: str) -> Response:
+    return request.app.state.static.response(request, name)
+
+
+static_router = Router(path="/static", route_handlers=[serve_static])
@@ -0,0 +1,305 @@
+"""Load test for the buzzer and host websockets.
+
+    python -m modules.bench --parties 4 --players 50 --rounds 20 > before.json
+
+Serves the buzzer and host routes with uvicorn on a unix socket inside this
+process and drives them with P parties of N players plus their hosts. The
+discord bot is left out, the parties and their users are created directly in
+the store. Every round resets the buzzers and has every player buzz at once,
+optionally with a multiple choice poll and some players reconnecting.
+
+The results are printed as JSON, so runs of different versions can be
+compared. CPU time includes the simulated clients, which share the process.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from time import monotonic, process_time
+
+import aiohttp
+import msgspec
+import uvicorn
+from litestar import Litestar
+
+from . import wire
+from .buzzer import buzzer_router
+from .host import host_router
+from .store import PartyStore
+from .types import UserProfile
+
+CHOICES = ["A", "B", "C", "D"]
+
+
+def percentile(samples: list[float], q: float) -> float | None:
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def latency_summary(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        name: (None if value is None else round(value * 1000, 3))
+        for name, value in (
+            ("p50", percentile(samples, 0.5)),
+            ("p99", percentile(samples, 0.99)),
+            ("p999", percentile(samples, 0.999)),
+            ("max", samples[-1] if samples else None),
+        )
+    }
+
+
+def decode(data: str | bytes) -> dict:
+    if isinstance(data, str):
+        return json.loads(data)
+    if data[:1] == bytes([wire.PING]):
+        _, ping_round = wire.PING_LAYOUT.unpack(data)
+        return {"event": "PING", "id": str(ping_round)}
+    if data[:1] == bytes([wire.BUZZ_ACK]):
+        _, received_at, position = wire.BUZZ_ACK_LAYOUT.unpack(data)
+        return {"event": "BUZZ_ACK", "t": received_at, "position": position}
+    if data[:1] == bytes([wire.LOCK]):
+        return {"event": "LOCK"}
+    return msgspec.msgpack.decode(data)
+
+
+class Client:
+    def __init__(self, bench: "Bench", party_id: str, code: str, host: bool = False):
+        self.bench = bench
+        self.party_id = party_id
+        self.code = code
+        self.host = host
+        self.ws: aiohttp.ClientWebSocketResponse | None = None
+        self.reader: asyncio.Task | None = None
+        self.buzzed_at: float | None = None
+
+    async def connect(self):
+        path = "host" if self.host else "buzzer"
+        while True:
+            ws = await self.bench.session.ws_connect(
+                f"http://bench/{path}/ws?format={self.bench.format}",
+                headers={"Cookie": f"party={self.party_id}; user={self.code}"},
+            )
+            # Wait for the snapshot, so the player is in the party from here on.
+            first = await ws.receive()
+            if first.type != aiohttp.WSMsgType.CLOSE:
+                break
+            # Deferred by the admission pacing, come back when told to.
+            self.bench.deferred += 1
+            retry = first.extra.split("=")[-1] if first.extra else ""
+            await asyncio.sleep(int(retry) / 1000 if retry.isdigit() else 1)
+        self.ws = ws
+        await self.handle(first)
+        self.reader = asyncio.create_task(self.read(ws))
+
+    async def disconnect(self):
+        if self.ws:
+            await self.ws.close()
+        if self.reader:
+            await self.reader
+
+    async def read(self, ws: aiohttp.ClientWebSocketResponse):
+        async for message in ws:
+            await self.handle(message)
+
+    async def handle(self, message: aiohttp.WSMessage):
+        now = monotonic()
+        self.bench.messages += 1
+        msg = decode(message.data)
+        if msg["event"] == "BUZZ_ACK" and self.buzzed_at is not None:
+            self.bench.ack_latencies.append(now - self.buzzed_at)
+            self.buzzed_at = None
+        elif msg["event"] == "PING":
+            await self.send({"event": "PONG", "id": msg["id"], "t": now})
+        elif msg["event"] == "DELTA":
+            for op in msg["ops"]:
+                if op["op"] == "buzz":
+                    self.bench.buzz_received(self.party_id, op["id"], now)
+        elif msg["event"] == "UPDATE":
+            self.bench.snapshots += 1
+
+    async def send(self, msg: dict):
+        assert self.ws
+        if msg["event"] == "BUZZ":
+            self.buzzed_at = msg["t"]
+        if self.bench.format == wire.BINARY and msg["event"] == "BUZZ":
+            await self.ws.send_bytes(wire.BUZZ_LAYOUT.pack(wire.BUZZ, msg["t"]))
+        elif self.bench.format == wire.BINARY and msg["event"] == "PONG":
+            data = wire.PONG_LAYOUT.pack(wire.PONG, int(msg["id"]), msg["t"])
+            await self.ws.send_bytes(data)
+        else:
+            await self.ws.send_str(json.dumps(msg))
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.format = args.format
+        self.app = Litestar(
+            route_handlers=[buzzer_router, host_router], logging_config=None
+        )
+        self.store = self.app.state.parties = PartyStore(self.app)
+        self.session: aiohttp.ClientSession
+        self.messages = 0
+        self.snapshots = 0
+        self.deferred = 0
+        self.buzzes = 0
+        self.latencies: list[float] = []
+        # From sending a buzz to its BUZZ_ACK, for the buzzing player only.
+        self.ack_latencies: list[float] = []
+        # When the buzz of each (party, player index) was sent this round.
+        self.buzz_sent: dict[tuple[str, int], float] = {}
+
+    def buzz_received(self, party_id: str, index: int, now: float):
+        sent = self.buzz_sent.get((party_id, index))
+        if sent is not None:
+            self.latencies.append(now - sent)
+
+    async def setup_party(self, n: int) -> tuple[Client, list[Client]]:
+        party_id = f"bench-{n}"
+        code = await self.store.create_party(
+            party_id, UserProfile(n * 100_000, f"host{n}", "")
+        )
+        host = Client(self, party_id, code, host=True)
+        players = []
+        for i in range(self.args.players):
+            profile = UserProfile(n * 100_000 + i + 1, f"player{n}-{i}", "")
+            code = await self.store.join_party(party_id, profile)
+            assert code
+            players.append(Client(self, party_id, code))
+        await host.connect()
+        await asyncio.gather(*(p.connect() for p in players))
+        return host, players
+
+    async def run_party(self, host: Client, players: list[Client]):
+        party = self.store.get(host.party_id)
+        assert party
+        settle = self.args.settle
+        for round in range(self.args.rounds):
+            await host.send({"event": "RESET"})
+            if party.locked:
+                await host.send({"event": "TOGGLE_LOCK"})
+            await asyncio.sleep(settle)
+
+            churn = random.sample(players, int(len(players) * self.args.churn))
+            for player in churn:
+                await player.disconnect()
+            await asyncio.gather(*(p.connect() for p in churn))
+            await asyncio.sleep(settle)
+
+            sends = []
+            for player in players:
+                index = party.connections[player.code].game_data.index
+                now = monotonic()
+                self.buzz_sent[(host.party_id, index)] = now
+                sends.append(player.send({"event": "BUZZ", "t": now}))
+            await asyncio.gather(*sends)
+            self.buzzes += len(sends)
+            await asyncio.sleep(settle)
+            for player in players:
+                index = party.connections[player.code].game_data.index
+                self.buzz_sent.pop((host.party_id, index), None)
+
+            if self.args.poll_every and round % self.args.poll_every == 0:
+                await host.send(
+                    {"event": "PROMPT_CHOICES", "choices": "\n".join(CHOICES)}
+                )
+                await asyncio.sleep(settle)
+                await asyncio.gather(
+                    *(
+                        p.send({"event": "MC_ANSWER", "answer": random.choice(CHOICES)})
+                        for p in players
+                    )
+                )
+                await asyncio.sleep(settle)
+                await host.send({"event": "END_MC"})
+                await host.send({"event": "CLEAR_MC"})
+
+    async def run(self) -> dict:
+        socket = os.path.join(tempfile.mkdtemp(), "bench.sock")
+        server = uvicorn.Server(
+            uvicorn.Config(self.app, uds=socket, log_level="warning", lifespan="off")
+        )
+        serve = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.UnixConnector(path=socket)
+        )
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        parties = await asyncio.gather(
+            *(self.setup_party(n) for n in range(self.args.parties))
+        )
+        state_before = self.party_bytes()
+
+        cpu, start = process_time(), monotonic()
+        await asyncio.gather(*(self.run_party(h, p) for h, p in parties))
+        cpu, elapsed = process_time() - cpu, monotonic() - start
+
+        state_after = self.party_bytes()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        for host, players in parties:
+            await asyncio.gather(host.disconnect(), *(p.disconnect() for p in players))
+        await self.session.close()
+        server.should_exit = True
+        await serve
+
+        return {
+            "config": vars(self.args),
+            "buzzes": self.buzzes,
+            "latency_samples": len(self.latencies),
+            "latency_ms": latency_summary(self.latencies),
+            "ack_latency_ms": latency_summary(self.ack_latencies),
+            "messages": self.messages,
+            "messages_per_second": round(self.messages / elapsed, 1),
+            "snapshots": self.snapshots,
+            "deferred_connects": self.deferred,
+            "elapsed_s": round(elapsed, 3),
+            "cpu_s": round(cpu, 3),
+            "cpu_s_per_party": round(cpu / self.args.parties, 3),
+            "max_rss_kib": {"before": rss_before, "after": rss_after},
+            "party_bytes": {"before": state_before, "after": state_after},
+        }
+
+    def party_bytes(self) -> int:
+        return sum(
+            u["state_bytes"] + u["outbox_bytes"]
+            for u in self.store.memory_usage().values()
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=4)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument(
+        "--poll-every", type=int, default=0, help="run a poll every N rounds"
+    )
+    parser.add_argument(
+        "--churn", type=float, default=0.0, help="share of players reconnecting"
+    )
+    parser.add_argument(
+        "--settle", type=float, default=0.2, help="seconds to wait between steps"
+    )
+    parser.add_argument("--format", choices=[wire.JSON, wire.BINARY], default=wire.JSON)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Keep stdout for the results.
+    with redirect_stdout(sys.stderr):
+        results = asyncio.run(Bench(args).run())
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from litestar import Router, Request, get, websocket
 from litestar.datastructures import Cookie
 from litestar.exceptions import HTTPException
-from litestar.response import Redirect, Template
+from litestar.response import Redirect, Response
 
 from modules.types import Party, PlayerConnection
 
@@ -13,43 +13,52 @@ async def listen_for_buzzes(socket: PlayerConnection) -> None:
     party: Party = socket.app.state.parties.get(socket.cookies.get("party", ""), None)
     logging.info("%s %s", party, socket.game_data.user_id)
     if party:
+        if not await party.admit(socket):
+            return
         async with party.connection(socket):
-            await party.update_buzzers()
-            while not socket.game_data.leaving:
-                msg = await socket.receive_json()
-
-                if socket != party.connections[socket.game_data.user_id]:
-                    await socket.close(code=1013, reason="How did this happen?")
-                    return
+            while True:
+                msg = await socket.receive_message()
 
+                # Everything that changes the party goes through its inbox,
+                # events from a replaced connection are dropped there.
                 try:
                     if "event" not in msg:
-                        print("Unknown ws message received")
+                        logging.warning("Unknown ws message received")
                         continue
                     elif msg["event"] == "BUZZ":
-                        party.player_buzz(socket)
+                        party.post(
+                            party.player_buzz,
+                            socket,
+                            msg.get("t"),
+                            party.clock.now(),
+                            sender=socket,
+                        )
                     elif msg["event"] == "LEAVE":
-                        socket.game_data.leaving = True
+                        party.post(party.player_left, socket, sender=socket)
                         await socket.close(code=1013, reason="You left.")
                         break
                     elif msg["event"] == "PONG":
-                        socket.received_rtt_pong(msg.get("id"))
+                        party.received_pong(socket, msg.get("id"), msg.get("t"))
+                    elif msg["event"] == "RESYNC":
+                        party.post(party.send_snapshot, socket, sender=socket)
                     elif msg["event"] == "MC_ANSWER":
-                        await party.received_mc_answer(
-                            socket, msg.get("answer").strip()
+                        party.post(
+                            party.received_mc_answer,
+                            socket,
+                            msg.get("answer").strip(),
+                            sender=socket,
                         )
                 except Exception as e:
                     logging.error("Failed handling websocket message", exc_info=e)
                     continue
     else:
-        print("No Party.")
+        logging.info("No party %s", socket.cookies.get("party"))
         raise HTTPException(status_code=400, detail="idiot")
 
 
 @get("/")
-async def no_buzzer(request: Request) -> Template | Redirect:
+async def no_buzzer(request: Request) -> Response | Redirect:
     error_code = request.query_params.get("error")
-    print(error_code, "code")
     error = None
     if error_code == "1":
         error = "The provided party code is invalid."
@@ -62,16 +71,14 @@ async def no_buzzer(request: Request) -> Template | Redirect:
     elif error_code:
         error = "An unknown error has occurred."
 
-    print(error)
     if error:
-        return Template("error.html", context={"error": error})
+        return request.app.state.pages.response(request, "error.html", error=error)
     else:
         return Redirect("/")
 
 
 @get("/{buzzer_id:str}")
-async def buzzer(request: Request, buzzer_id: str) -> Template | Redirect:
-    print("got this!")
+async def buzzer(request: Request, buzzer_id: str) -> Response | Redirect:
     user = request.query_params.get("user")
 
     party = request.app.state.parties.get(buzzer_id)
@@ -85,7 +92,8 @@ async def buzzer(request: Request, buzzer_id: str) -> Template | Redirect:
     elif user not in party.users:
         return Redirect("/buzzer", query_params={"error": "3"})
 
-    return Template(
+    return request.app.state.pages.response(
+        request,
         "buzzer.html",
         cookies=[Cookie(key="party", value=buzzer_id), Cookie(key="user", value=user)],
     )
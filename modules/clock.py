@@ -0,0 +1,73 @@
+"""Where the parties get the time from.
+
+Everything time related in a party (timestamps, update frames, pings, the
+reaper) goes through a ``Clock`` instead of calling ``time.monotonic`` and
+``asyncio.sleep`` directly, so it can run on something other than real time.
+
+``VirtualTimeLoop`` is an event loop whose clock jumps straight to the next
+timer whenever nothing is ready to run. Together with ``LoopClock`` it lets
+``modules.sim`` play a whole quiz night deterministically in a few seconds.
+"""
+
+import asyncio
+from time import monotonic
+
+
+class Clock:
+    """Real time."""
+
+    def now(self) -> float:
+        return monotonic()
+
+    async def sleep(self, delay: float):
+        await asyncio.sleep(delay)
+
+
+class LoopClock(Clock):
+    """The time of the running event loop, virtual or not."""
+
+    def now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+
+REAL_CLOCK = Clock()
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop that skips the waiting.
+
+    Whenever the loop would block until its next timer, time moves forward by
+    that much instead. Real I/O is still polled, without waiting, so only use
+    it for code that talks to itself, e.g. an app driven through ASGI.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.virtual_time = 0.0
+        # Not public, but the only place where the loop waits.
+        select = self._selector.select  # type: ignore[attr-defined]
+
+        def advance(timeout: float | None = None):
+            if timeout is None:
+                # Nothing scheduled at all, only a thread can wake us up now.
+                return select(None)
+            events = select(0)
+            if not events:
+                self.virtual_time += timeout
+            return events
+
+        self._selector.select = advance  # type: ignore[attr-defined]
+
+    def time(self) -> float:
+        return self.virtual_time
+
+
+def run_virtual(main):
+    """Like ``asyncio.run``, but in virtual time."""
+    loop = VirtualTimeLoop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,274 @@
+"""Runs the site as several worker processes behind a small routing proxy.
+
+    python -m modules.cluster --workers 4 --port 8000
+
+Every worker serves ``app:app`` on its own unix socket and owns the parties
+whose id hashes to it. The proxy forwards each request and websocket to the
+worker owning the party in the path (``/buzzer/{id}``, ``/host/{id}``,
+``/watch/{id}``) or in the ``party`` cookie, anything else goes to worker 0,
+which also runs the discord bot unless ``--external-bot`` runs it in a
+process of its own. ``/metrics`` is answered by the proxy with the metrics of
+all workers.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+from http.cookies import SimpleCookie
+from secrets import token_urlsafe
+
+import aiohttp
+import uvicorn
+
+from .metrics import merge_workers
+from .store import shard_for, socket_path
+
+PARTY_ROUTES = ("buzzer", "host")
+HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade"}
+
+
+class ClusterProxy:
+    def __init__(self, workers: int, socket_dir: str) -> None:
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.sessions: list[aiohttp.ClientSession] = []
+
+    def route(self, scope) -> int:
+        parts = scope["path"].strip("/").split("/")
+        if len(parts) >= 2 and parts[0] in PARTY_ROUTES and parts[1] != "ws":
+            party_id = parts[1]
+        elif len(parts) >= 2 and parts[0] == "watch":
+            party_id = parts[1]
+        else:
+            cookies = SimpleCookie()
+            for key, value in scope["headers"]:
+                if key == b"cookie":
+                    cookies.load(value.decode("latin-1"))
+            party_id = cookies["party"].value if "party" in cookies else None
+        return shard_for(party_id, self.workers) if party_id else 0
+
+    def upstream_url(self, scope, worker: int) -> str:
+        url = f"http://worker-{worker}{scope['raw_path'].decode()}"
+        if scope["query_string"]:
+            url += "?" + scope["query_string"].decode()
+        return url
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["path"].startswith("/_ipc"):
+            if scope["type"] == "http":
+                await send({"type": "http.response.start", "status": 404})
+                await send({"type": "http.response.body", "body": b""})
+            else:
+                await send({"type": "websocket.close", "code": 1008})
+            return
+
+        if scope["type"] == "http" and scope["path"] == "/metrics":
+            return await self.serve_metrics(send)
+
+        worker = self.route(scope)
+        if scope["type"] == "http":
+            await self.proxy_http(scope, receive, send, worker)
+        elif scope["type"] == "websocket":
+            await self.proxy_websocket(scope, receive, send, worker)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.sessions = [
+                    aiohttp.ClientSession(
+                        connector=aiohttp.UnixConnector(
+                            path=socket_path(self.socket_dir, worker)
+                        ),
+                        auto_decompress=False,
+                        # The clients' cookies pass through, the proxy keeps none.
+                        cookie_jar=aiohttp.DummyCookieJar(),
+                    )
+                    for worker in range(self.workers)
+                ]
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for session in self.sessions:
+                    await session.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def serve_metrics(self, send):
+        async def scrape(session: aiohttp.ClientSession) -> str:
+            try:
+                async with session.get("http://worker/metrics") as resp:
+                    return await resp.text()
+            except aiohttp.ClientError:
+                return ""
+
+        texts = await asyncio.gather(*(scrape(s) for s in self.sessions))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain; version=0.0.4")],
+            }
+        )
+        await send(
+            {"type": "http.response.body", "body": merge_workers(texts).encode()}
+        )
+
+    async def proxy_http(self, scope, receive, send, worker: int):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        headers = [
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in scope["headers"]
+            if k not in HOP_HEADERS
+        ]
+        async with self.sessions[worker].request(
+            scope["method"],
+            self.upstream_url(scope, worker),
+            headers=headers,
+            data=body,
+            allow_redirects=False,
+        ) as resp:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": resp.status,
+                    "headers": [
+                        (k.lower(), v)
+                        for k, v in resp.raw_headers
+                        if k.lower() not in HOP_HEADERS
+                    ],
+                }
+            )
+            async for chunk in resp.content.iter_any():
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body", "body": b""})
+
+    async def proxy_websocket(self, scope, receive, send, worker: int):
+        await receive()  # websocket.connect
+        headers = [
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in scope["headers"]
+            if k == b"cookie"
+        ]
+        try:
+            upstream = await self.sessions[worker].ws_connect(
+                self.upstream_url(scope, worker), headers=headers, autoclose=False
+            )
+        except aiohttp.WSServerHandshakeError:
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send({"type": "websocket.accept"})
+
+        async def client_to_worker():
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    await upstream.close(code=message.get("code", 1000))
+                    return
+                if message.get("text") is not None:
+                    await upstream.send_str(message["text"])
+                elif message.get("bytes") is not None:
+                    await upstream.send_bytes(message["bytes"])
+
+        async def worker_to_client():
+            while True:
+                message = await upstream.receive()
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await send({"type": "websocket.send", "text": message.data})
+                elif message.type == aiohttp.WSMsgType.BINARY:
+                    await send({"type": "websocket.send", "bytes": message.data})
+                elif message.type == aiohttp.WSMsgType.CLOSE:
+                    # Pass the close code and reason on, the clients rely on them.
+                    await send(
+                        {
+                            "type": "websocket.close",
+                            "code": message.data,
+                            "reason": message.extra or "",
+                        }
+                    )
+                    return
+                else:
+                    await send({"type": "websocket.close", "code": 1011})
+                    return
+
+        tasks = [
+            asyncio.create_task(client_to_worker()),
+            asyncio.create_task(worker_to_client()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket-dir", default="/tmp")
+    parser.add_argument(
+        "--external-bot",
+        action="store_true",
+        help="run the discord bot in its own process",
+    )
+    args = parser.parse_args()
+
+    env = {
+        **os.environ,
+        "BUZZER_WORKERS": str(args.workers),
+        "BUZZER_SOCKET_DIR": args.socket_dir,
+        "BUZZER_IPC_TOKEN": token_urlsafe(32),
+    }
+    if args.external_bot:
+        env["BUZZER_BOT"] = "external"
+    workers = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app:app",
+                "--uds",
+                socket_path(args.socket_dir, worker),
+                "--ws-per-message-deflate",
+                "true",
+            ],
+            env={**env, "BUZZER_WORKER": str(worker)},
+        )
+        for worker in range(args.workers)
+    ]
+    if args.external_bot:
+        workers.append(
+            subprocess.Popen([sys.executable, "-m", "modules.discord_bot"], env=env)
+        )
+    try:
+        uvicorn.run(
+            ClusterProxy(args.workers, args.socket_dir),
+            host=args.host,
+            port=args.port,
+            proxy_headers=False,
+            ws_per_message_deflate=True,
+        )
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,62 @@
+"""The discord bot creating the parties and handing out the join links.
+
+By default it runs inside the web process (``bot_start_lifespan``). To keep
+gateway work off the web tier's event loop, start the web tier with
+``BUZZER_BOT=external`` and run the bot on its own:
+
+    BUZZER_IPC_URL=http://127.0.0.1:8000 python -m modules.discord_bot
+
+Both processes need the same ``BUZZER_IPC_TOKEN``. Without ``BUZZER_IPC_URL``
+the bot talks to the cluster workers' sockets instead.
+"""
+
 from __future__ import annotations
 
 import asyncio
+import logging
 from contextlib import asynccontextmanager
+from datetime import timedelta
+from functools import cache, partial
 from secrets import token_urlsafe
 
 import discord
 from discord import app_commands
 from litestar import Litestar
 
-from config import BOT_TOKEN, BASE_URL
+from .outbound import Dispatcher
+from .store import (
+    IPC_TOKEN,
+    IPC_URL,
+    SOCKET_DIR,
+    WORKERS,
+    IpcClient,
+    PartyStore,
+    RemotePartyStore,
+)
+from .types import UserProfile
+
+# Interaction tokens, and with them the room message's edits, expire after 15
+# minutes. Stop a little earlier so an edit in flight doesn't fail.
+TOKEN_LIFETIME = timedelta(minutes=14)
+
+# The loop only keeps weak references to tasks, these must not be collected
+# before they are done.
+background_tasks: set[asyncio.Task] = set()
 
-from .types import Party
+
+@cache
+def load_config():
+    # Imported on first use, so the site can boot without a config.py.
+    import config
+
+    return config
 
 
 class RoomInitiator(discord.Client):
     def __init__(self) -> None:
         super().__init__(intents=discord.Intents.none())
-        self._app: Litestar | None = None
+        self._parties: PartyStore | RemotePartyStore | None = None
+        self.dispatcher: Dispatcher
         self.tree = app_commands.CommandTree(
             self,
             allowed_contexts=app_commands.AppCommandContext(
@@ -26,10 +66,18 @@ class RoomInitiator(discord.Client):
         )
 
     @property
-    def app(self):
-        if not self._app:
-            raise RuntimeError("Bot has no app bound to it")
-        return self._app
+    def parties(self) -> PartyStore | RemotePartyStore:
+        if not self._parties:
+            raise RuntimeError("Bot has no party store bound to it")
+        return self._parties
+
+    async def setup_hook(self) -> None:
+        self.dispatcher = Dispatcher()
+
+    async def close(self) -> None:
+        if hasattr(self, "dispatcher"):
+            await self.dispatcher.close()
+        await super().close()
 
 
 client = RoomInitiator()
@@ -53,38 +101,99 @@ class Join(discord.ui.View):
         )
 
 
+def link_embed() -> discord.Embed:
+    return discord.Embed(
+        description="## DO NOT share this link with anyone."
+        "\nEach participant must click join individually.",
+        colour=discord.Colour.yellow(),
+    )
+
+
 class JoinRoomView(discord.ui.View):
-    def __init__(self, owner: discord.abc.User, party: Party, board_name: str | None):
+    def __init__(
+        self,
+        owner: discord.abc.User,
+        party_id: str,
+        board_name: str | None,
+        channel_id: int | None,
+    ):
         super().__init__(timeout=None)
-        manage_url = f"{BASE_URL}/host/{party.id}"
-        self.embed = discord.Embed(
-            title="Buzzer Round",
-            description=f"Hosted by {owner.mention}"
-            + f"\nParty ID: `{party.id}` [manage](<{manage_url}>)"
-            + (f"\nBoard Name:{board_name}" if board_name else ""),
-        )
         self.owner = owner
         self.board_name = board_name
-        self.party = party
+        self.party_id = party_id
         self.last_bump = discord.utils.utcnow()
+        # Requests for the room message share the channel's rate limit.
+        self.bucket = f"channel:{channel_id}"
+        self.message: discord.InteractionMessage | discord.WebhookMessage | None = None
+        self.editable_until = discord.utils.utcnow()
+        self.players: set[int] = set()
+
+    @property
+    def embed(self) -> discord.Embed:
+        manage_url = f"{load_config().BASE_URL}/host/{self.party_id}"
+        return discord.Embed(
+            title="Buzzer Round",
+            description=f"Hosted by {self.owner.mention}"
+            + f"\nParty ID: `{self.party_id}` [manage](<{manage_url}>)"
+            + (f"\nBoard Name:{self.board_name}" if self.board_name else "")
+            + (f"\nPlayers: {len(self.players)}" if self.players else ""),
+        )
+
+    def track(
+        self,
+        message: discord.InteractionMessage | discord.WebhookMessage,
+        interaction: discord.Interaction,
+    ):
+        """Remembers the room message, editable as long as the interaction is."""
+        self.message = message
+        self.editable_until = interaction.created_at + TOKEN_LIFETIME
+
+    @property
+    def editable(self) -> bool:
+        return bool(self.message) and discord.utils.utcnow() < self.editable_until
+
+    def refresh(self):
+        """Updates the player count, repeated refreshes become one edit.
+
+        Once the message can't be edited anymore the count waits for the next
+        bump instead.
+        """
+        if self.editable:
+            key = f"edit:{self.party_id}"
+            client.dispatcher.send(self.bucket, self.edit, key=key)
+
+    async def edit(self):
+        if self.editable:
+            await self.message.edit(embed=self.embed, view=self)
+
+    async def bump(self, interaction: discord.Interaction):
+        await interaction.delete_original_response()
+        message = await interaction.followup.send(
+            view=self, embed=self.embed, wait=True
+        )
+        self.track(message, interaction)
 
     @discord.ui.button(label="Join", style=discord.ButtonStyle.green)
     async def join_game(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         """Sends an ephemeral message with a user-specific join link"""
-        codes = [c for c, u in self.party.users.items() if u.id == interaction.user.id]
-        code = codes[0] if codes else token_urlsafe(16)
-        self.party.users[code] = interaction.user
-        url = f"{BASE_URL}/buzzer/{self.party.id}?user={code}"
-        embed = discord.Embed(
-            description="## DO NOT share this link with anyone."
-            "\nEach participant must click join individually.",
-            colour=discord.Colour.yellow(),
+        code = await client.parties.join_party(
+            self.party_id, UserProfile.from_discord(interaction.user)
         )
+        if not code:
+            return await interaction.response.send_message(
+                "This buzzer session has ended.", ephemeral=True
+            )
+        url = f"{load_config().BASE_URL}/buzzer/{self.party_id}?user={code}"
+        # Interaction responses have no shared rate limit, so they go out
+        # directly, only the room message edit is queued.
         await interaction.response.send_message(
-            embed=embed, view=Join(url), ephemeral=True
+            embed=link_embed(), view=Join(url), ephemeral=True
         )
+        if interaction.user.id not in self.players:
+            self.players.add(interaction.user.id)
+            self.refresh()
 
     @discord.ui.button(
         emoji="\N{DOWNWARDS BLACK ARROW}\N{VARIATION SELECTOR-16}",
@@ -93,10 +202,16 @@ class JoinRoomView(discord.ui.View):
     async def resend(self, interaction: discord.Interaction, _: discord.ui.Button):
         if interaction.user != self.owner:
             return await interaction.response.defer()
+        if not await client.parties.lookup(self.party_id):
+            return await interaction.response.send_message(
+                "This buzzer session has ended.", ephemeral=True
+            )
 
         await interaction.response.defer()
-        await interaction.delete_original_response()
-        await interaction.followup.send(view=self, embed=self.embed)
+        # A burst of clicks only moves the message down once.
+        client.dispatcher.send(
+            self.bucket, partial(self.bump, interaction), key=f"bump:{self.party_id}"
+        )
 
 
 @buzzer_cmd.command(name="create")
@@ -104,28 +219,92 @@ class JoinRoomView(discord.ui.View):
 async def buzzer_create(interaction: discord.Interaction, board_name: str | None):
     """Creates a new buzzer session."""
     room_id = token_urlsafe(6)
-    client.app.state.parties[room_id] = party = Party(room_id, client.app)
-    view = JoinRoomView(owner=interaction.user, party=party, board_name=board_name)
-    await interaction.response.send_message(view=view, embed=view.embed)
-
-    code = token_urlsafe(16)
-    party.users[code] = interaction.user
-
-    party.host = code
+    code = await client.parties.create_party(
+        room_id, UserProfile.from_discord(interaction.user)
+    )
+    view = JoinRoomView(
+        owner=interaction.user,
+        party_id=room_id,
+        board_name=board_name,
+        channel_id=interaction.channel_id,
+    )
+    response = await interaction.response.send_message(view=view, embed=view.embed)
+    if isinstance(response.resource, discord.InteractionMessage):
+        view.track(response.resource, interaction)
 
     await interaction.followup.send(
         f"{interaction.user.mention} manage your buzzer here:"
-        f"\n<{BASE_URL}/host/{party.id}?user={code}>"
+        f"\n<{load_config().BASE_URL}/host/{room_id}?user={code}>"
         "\n## You must click this link first, but if you lose the tab you can click on manage on the main message."
         "\nAlso do not share this link with anyone.",
         ephemeral=True,
     )
 
 
+@buzzer_cmd.command(name="recover")
+@app_commands.describe(room="The party ID of the buzzer session")
+async def buzzer_recover(interaction: discord.Interaction, room: str):
+    """Sends every player of your buzzer session their join link again."""
+    members = await client.parties.members(room)
+    if not members or members["host"] != interaction.user.id:
+        return await interaction.response.send_message(
+            "You are not hosting a buzzer session with that ID.", ephemeral=True
+        )
+
+    players: dict[str, int] = members["players"]
+    await interaction.response.send_message(
+        f"Sending {len(players)} join links...", ephemeral=True
+    )
+    sends = [
+        client.dispatcher.send(f"dm:{user_id}", partial(send_link, user_id, room, code))
+        for code, user_id in players.items()
+    ]
+    # Report back once they are out, without holding up the command.
+    task = asyncio.create_task(report_recovery(interaction, sends))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def send_link(user_id: int, party_id: str, code: str):
+    url = f"{load_config().BASE_URL}/buzzer/{party_id}?user={code}"
+    channel = await client.create_dm(discord.Object(user_id))
+    await channel.send(embed=link_embed(), view=Join(url))
+
+
+async def report_recovery(interaction: discord.Interaction, sends: list):
+    results = await asyncio.gather(*sends, return_exceptions=True)
+    sent = sum(not isinstance(r, BaseException) for r in results)
+    await interaction.edit_original_response(
+        content=f"Sent {sent} of {len(sends)} join links."
+    )
+
+
 @asynccontextmanager
 async def bot_start_lifespan(app: Litestar):
-    client._app = app
+    client._parties = app.state.parties
+    app.state.bot_ready = client.is_ready
     async with client:
-        asyncio.create_task(client.start(BOT_TOKEN))
-        await client.wait_until_ready()
+        # Don't wait for discord, the site serves right away and the bot
+        # handles commands once it is connected.
+        task = asyncio.create_task(client.start(load_config().BOT_TOKEN))
+        task.add_done_callback(log_bot_exit)
         yield
+
+
+def log_bot_exit(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logging.error("Discord bot stopped", exc_info=task.exception())
+
+
+async def run_bot():
+    parties = RemotePartyStore(IpcClient(WORKERS, SOCKET_DIR, IPC_TOKEN, IPC_URL))
+    client._parties = parties
+    try:
+        async with client:
+            await client.start(load_config().BOT_TOKEN)
+    finally:
+        await parties.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_bot())
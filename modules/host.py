@@ -1,42 +1,112 @@
 from litestar import Router, Request, get, websocket
 from litestar.datastructures import Cookie
 from litestar.exceptions import HTTPException
-from litestar.response import Redirect, Template
+from litestar.response import Redirect, Response
 
+from modules.scores import MAX_AWARD
 from modules.types import Party, PlayerConnection
 
+import logging
+
+# Host commands, a BATCH carries a list of them in "ops".
+COMMANDS = (
+    "RESET",
+    "TOGGLE_LOCK",
+    "SET_LOCK",
+    "SET_LOCK_AFTER",
+    "PROMPT_CHOICES",
+    "CLEAR_MC",
+    "END_MC",
+    "AWARD",
+    "MARK_CORRECT",
+)
+
+
+def is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def valid_points(value) -> bool:
+    return is_int(value) and abs(value) <= MAX_AWARD
+
+
+def valid_command(msg: dict) -> bool:
+    event = msg.get("event")
+    if event == "BATCH":
+        ops = msg.get("ops")
+        return isinstance(ops, list) and all(
+            isinstance(op, dict) and op.get("event") in COMMANDS and valid_command(op)
+            for op in ops
+        )
+    if event == "SET_LOCK":
+        return isinstance(msg.get("locked"), bool)
+    if event == "SET_LOCK_AFTER":
+        count = msg.get("count")
+        return is_int(count) and count >= 0
+    if event == "AWARD":
+        return is_int(msg.get("id")) and valid_points(msg.get("points"))
+    if event == "MARK_CORRECT":
+        return isinstance(msg.get("choice"), str) and valid_points(msg.get("points"))
+    if event == "PROMPT_CHOICES":
+        return isinstance(msg.get("choices"), str)
+    return event in COMMANDS
+
+
+def apply_command(party: Party, msg: dict):
+    """Applies a validated host command.
+
+    A BATCH is a single inbox event, so its ops are applied back to back and
+    the players get one update for all of them.
+    """
+    event = msg["event"]
+    if event == "BATCH":
+        for op in msg["ops"]:
+            apply_command(party, op)
+    elif event == "RESET":
+        party.reset_buzzers()
+    elif event == "TOGGLE_LOCK":
+        party.toggle_lock()
+    elif event == "SET_LOCK":
+        party.set_lock(msg["locked"])
+    elif event == "SET_LOCK_AFTER":
+        party.set_lock_after(msg["count"])
+    elif event == "PROMPT_CHOICES":
+        party.prompt_multiple_choice(
+            [m.strip() for m in msg["choices"].strip().splitlines()]
+        )
+    elif event == "CLEAR_MC":
+        party.clear_multiple_choice()
+    elif event == "END_MC":
+        party.end_multiple_choice()
+    elif event == "AWARD":
+        party.award({msg["id"]: msg["points"]})
+    elif event == "MARK_CORRECT":
+        party.mark_correct(msg["choice"], msg["points"])
+
 
 @websocket("ws", websocket_class=PlayerConnection)
 async def host_config_ws(socket: PlayerConnection) -> None:
     party: Party = socket.app.state.parties.get(socket.cookies.get("party", ""), None)
+    if party and socket.cookies.get("user") != party.host:
+        logging.warning("Refused host socket of a player in %s", party.id)
+        raise HTTPException(status_code=403, detail="Not the host of this party")
     if party:
         async with party.host_connection(socket):
             while True:
-                msg = await socket.receive_json()
-                if msg["event"] == "RESET":
-                    await party.reset_buzzers()
-                elif msg["event"] == "TOGGLE_LOCK":
-                    party.locked = not party.locked
-                    await party.update_buzzers()
-                elif msg["event"] == "PROMPT_CHOICES":
-                    await party.prompt_multiple_choice(
-                        [m.strip() for m in msg["choices"].strip().splitlines()]
-                    )
-                elif msg["event"] == "CLEAR_MC":
-                    party.available_choices = None
-                    party.show_choices = False
-                    for c in party.all_connections:
-                        c.game_data.choice = None
-                    await party.update_buzzers()
-                elif msg["event"] == "END_MC":
-                    await party.end_multiple_choice()
+                msg = await socket.receive_message()
+                if msg.get("event") == "RESYNC":
+                    party.send_snapshot(socket, host=True)
+                elif valid_command(msg):
+                    party.post(apply_command, party, msg)
+                else:
+                    logging.warning("Invalid host command %s", msg.get("event"))
     else:
-        print("No Party.")
+        logging.info("No party %s", socket.cookies.get("party"))
         raise HTTPException(status_code=400, detail="No Party")
 
 
 @get("/")
-async def no_buzzer(request: Request) -> Template | Redirect:
+async def no_buzzer(request: Request) -> Response | Redirect:
     error_code = request.query_params.get("error")
     error = None
     if error_code == "1":
@@ -51,13 +121,24 @@ async def no_buzzer(request: Request) -> Template | Redirect:
     elif error_code:
         error = "An unknown error has occurred."
     if error_code:
-        return Template("error.html", context={"error": error})
+        return request.app.state.pages.response(request, "error.html", error=error)
     else:
         return Redirect("/")
 
 
+@get("/{buzzer_id:str}/export")
+async def export_scores(request: Request, buzzer_id: str) -> Response:
+    party: Party = request.app.state.parties.get(buzzer_id)
+    if not party or request.cookies.get("user") != party.host:
+        raise HTTPException(status_code=403, detail="Not the host of this party")
+    return Response(
+        party.export(),
+        headers={"Content-Disposition": f'attachment; filename="{buzzer_id}.json"'},
+    )
+
+
 @get("/{buzzer_id:str}")
-async def host(request: Request, buzzer_id: str) -> Template | Redirect:
+async def host(request: Request, buzzer_id: str) -> Response | Redirect:
     user = request.query_params.get("user")
 
     party: Party = request.app.state.parties.get(buzzer_id)
@@ -72,10 +153,13 @@ async def host(request: Request, buzzer_id: str) -> Template | Redirect:
         if user in party.users:
             return Redirect(f"/buzzer/{buzzer_id}", query_params={"user": user})
 
-    return Template(
+    return request.app.state.pages.response(
+        request,
         "host.html",
         cookies=[Cookie(key="party", value=buzzer_id), Cookie(key="user", value=user)],
     )
 
 
-host_router = Router(path="/host", route_handlers=[host, no_buzzer, host_config_ws])
+host_router = Router(
+    path="/host", route_handlers=[host, no_buzzer, host_config_ws, export_scores]
+)
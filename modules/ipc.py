@@ -0,0 +1,46 @@
+from litestar import Request, Router, post
+from litestar.connection import ASGIConnection
+from litestar.exceptions import NotAuthorizedException
+from litestar.handlers import BaseRouteHandler
+
+from modules.store import IPC_HEADER, IPC_TOKEN
+from modules.types import UserProfile
+
+
+def ipc_guard(connection: ASGIConnection, _: BaseRouteHandler) -> None:
+    # Only reachable by the other workers, which get the token on startup.
+    if not IPC_TOKEN or connection.headers.get(IPC_HEADER) != IPC_TOKEN:
+        raise NotAuthorizedException()
+
+
+@post("/create", status_code=200)
+async def ipc_create(request: Request, data: dict) -> dict:
+    code = await request.app.state.parties.create_party(
+        data["party_id"], UserProfile(**data["user"])
+    )
+    return {"code": code}
+
+
+@post("/join", status_code=200)
+async def ipc_join(request: Request, data: dict) -> dict:
+    code = await request.app.state.parties.join_party(
+        data["party_id"], UserProfile(**data["user"])
+    )
+    return {"code": code}
+
+
+@post("/lookup", status_code=200)
+async def ipc_lookup(request: Request, data: dict) -> dict:
+    return {"party": await request.app.state.parties.lookup(data["party_id"])}
+
+
+@post("/members", status_code=200)
+async def ipc_members(request: Request, data: dict) -> dict:
+    return {"members": await request.app.state.parties.members(data["party_id"])}
+
+
+ipc_router = Router(
+    path="/_ipc",
+    route_handlers=[ipc_create, ipc_join, ipc_lookup, ipc_members],
+    guards=[ipc_guard],
+)
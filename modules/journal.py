@@ -0,0 +1,248 @@
+"""Keeps the parties on disk, so they survive a restart or a crash.
+
+Every change to a party is appended to an in-memory list, which a background
+task writes to SQLite in batches, so the hot paths never wait on the disk.
+Once a party has collected enough events they are replaced by a compact dump
+of its state. On startup nothing is loaded until a party is asked for.
+
+Enabled by setting ``BUZZER_JOURNAL`` to the path of the database.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from time import monotonic
+
+from .scores import Scoreboard
+
+JOURNAL_PATH = os.environ.get("BUZZER_JOURNAL", "")
+FLUSH_INTERVAL = 0.5
+# Events a party may collect before they are folded into a new dump.
+COMPACT_AFTER = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    party_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_party ON events (party_id, id);
+CREATE TABLE IF NOT EXISTS dumps (
+    party_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+def empty_state() -> dict:
+    return {
+        "users": {},
+        "host": None,
+        "locked": False,
+        "lock_after": 0,
+        "available_choices": None,
+        "show_choices": False,
+        "next_index": 0,
+        "players": {},
+        "scores": Scoreboard().dump(),
+    }
+
+
+def apply_event(state: dict, event: dict):
+    """Replays a journaled event on a dumped party state."""
+    kind = event["kind"]
+    players = state["players"]
+    if "id" in event:
+        player = players.setdefault(event["id"], {"user_id": event["id"]})
+
+    if kind == "user":
+        state["users"][event["code"]] = event["user"]
+        if event["host"]:
+            state["host"] = event["code"]
+    elif kind == "player":
+        player["index"] = event["index"]
+        state["next_index"] = max(state["next_index"], event["index"] + 1)
+    elif kind == "buzz":
+        player.update(buzzed=True, buzzed_at=event["at"], buzz_margin=event["margin"])
+    elif kind == "reset":
+        for player in players.values():
+            player.update(buzzed=False, buzzed_at=0.0, buzz_logged=False)
+    elif kind == "lock":
+        state["locked"] = event["locked"]
+    elif kind == "lock_after":
+        state["lock_after"] = event["count"]
+    elif kind == "prompt":
+        state.update(available_choices=event["choices"], locked=True)
+        state["show_choices"] = False
+        for player in players.values():
+            player["choice"] = None
+    elif kind == "answer":
+        player["choice"] = event["choice"]
+    elif kind == "reveal":
+        state["show_choices"] = True
+    elif kind == "end_mc":
+        state.update(show_choices=True, available_choices=None)
+    elif kind == "clear_mc":
+        state.update(show_choices=False, available_choices=None)
+        for player in players.values():
+            player["choice"] = None
+    elif kind == "leave":
+        player["leaving"] = True
+    elif kind in ("award", "round", "correct"):
+        if kind == "round" and event["round"]:
+            order = set(event["round"]["order"])
+            for player in players.values():
+                if player.get("index", -1) in order:
+                    player["buzz_logged"] = True
+        apply_score_event(state.setdefault("scores", Scoreboard().dump()), event)
+
+
+def apply_score_event(scores: dict, event: dict):
+    kind = event["kind"]
+    position = event.get("position")
+    if isinstance(position, int) and position < len(scores["rounds"]):
+        target = scores["rounds"][position]
+    else:
+        target = scores["current"]
+
+    if kind == "award":
+        awards = event["awards"]
+        for index, points in zip(awards[::2], awards[1::2]):
+            for column in (scores["points"], scores["penalties"]):
+                column.extend([0] * (index + 1 - len(column)))
+            scores["points"][index] += points
+            if points < 0 and event.get("penalty", True):
+                scores["penalties"][index] -= points
+        target["awards"].extend(awards)
+    elif kind == "round":
+        if event["round"]:
+            scores["rounds"].append(event["round"])
+        scores["current"] = event["next"]
+    elif kind == "correct":
+        target.update(
+            correct=event["choice"],
+            correct_points=event["points"],
+            scored=event.get("scored", []),
+        )
+
+
+class Journal:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # Writes happen in a worker thread, reads on the event loop. WAL lets
+        # the two connections work side by side.
+        self.writer = sqlite3.connect(path, check_same_thread=False)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+        self.writer.executescript(SCHEMA)
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.party_ids: set[str] = {
+            row[0]
+            for row in self.reader.execute(
+                "SELECT party_id FROM dumps UNION SELECT party_id FROM events"
+            )
+        }
+        self.pending: list[tuple[str, dict]] = []
+        self.event_counts: dict[str, int] = {}
+        self.dropped: set[str] = set()
+        self.writing: asyncio.Future | None = None
+
+    def append(self, party_id: str, event: dict):
+        self.pending.append((party_id, event))
+        self.party_ids.add(party_id)
+
+    def drop(self, party_id: str):
+        self.party_ids.discard(party_id)
+        self.event_counts.pop(party_id, None)
+        self.dropped.add(party_id)
+
+    def __contains__(self, party_id: str) -> bool:
+        return party_id in self.party_ids
+
+    def load(self, party_id: str) -> dict | None:
+        """Returns the party's state as of its last written event."""
+        row = self.reader.execute(
+            "SELECT data FROM dumps WHERE party_id = ?", (party_id,)
+        ).fetchone()
+        state = json.loads(row[0]) if row else empty_state()
+        events = self.reader.execute(
+            "SELECT data FROM events WHERE party_id = ? ORDER BY id", (party_id,)
+        ).fetchall()
+        if not row and not events:
+            return None
+        for (data,) in events:
+            apply_event(state, json.loads(data))
+        # Pending events (if any) belong to a party that is still in memory,
+        # so they never need replaying here.
+        self.event_counts[party_id] = len(events)
+        return state
+
+    async def run(self, dump):
+        """Writes the pending events every FLUSH_INTERVAL.
+
+        ``dump`` returns the current state of a party, or None if it is gone.
+        """
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush(dump)
+
+    async def flush(self, dump):
+        if not self.pending and not self.dropped:
+            return
+        batch, self.pending = self.pending, []
+        dropped, self.dropped = self.dropped, set()
+        dumps = {}
+        for party_id, _ in batch:
+            count = self.event_counts.get(party_id, 0) + 1
+            self.event_counts[party_id] = count
+            if count >= COMPACT_AFTER and party_id not in dumps:
+                state = dump(party_id)
+                if state is not None:
+                    dumps[party_id] = state
+                    self.event_counts[party_id] = 0
+
+        start = monotonic()
+        # Shielded so a cancelled flush still finishes its transaction.
+        self.writing = asyncio.ensure_future(
+            asyncio.to_thread(self.write, batch, dumps, dropped)
+        )
+        await asyncio.shield(self.writing)
+        logging.debug(
+            "Journaled %s events, %s dumps in %.1fms",
+            len(batch),
+            len(dumps),
+            (monotonic() - start) * 1000,
+        )
+
+    def write(self, batch: list[tuple[str, dict]], dumps: dict, dropped: set[str]):
+        with self.writer:
+            self.writer.executemany(
+                "INSERT INTO events (party_id, data) VALUES (?, ?)",
+                [
+                    (party_id, json.dumps(event))
+                    for party_id, event in batch
+                    if party_id not in dumps and party_id not in dropped
+                ],
+            )
+            for party_id, state in dumps.items():
+                self.writer.execute(
+                    "INSERT OR REPLACE INTO dumps (party_id, data) VALUES (?, ?)",
+                    (party_id, json.dumps(state)),
+                )
+                self.writer.execute(
+                    "DELETE FROM events WHERE party_id = ?", (party_id,)
+                )
+            for party_id in dropped:
+                self.writer.execute("DELETE FROM dumps WHERE party_id = ?", (party_id,))
+                self.writer.execute(
+                    "DELETE FROM events WHERE party_id = ?", (party_id,)
+                )
+
+    async def close(self, dump):
+        if self.writing:
+            await self.writing
+        await self.flush(dump)
+        self.writer.close()
+        self.reader.close()
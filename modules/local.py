@@ -0,0 +1,48 @@
+"""Bot-less mode, for development or restarting quickly during a live event.
+
+    BUZZER_LOCAL=1 uvicorn app:app
+
+Discord is never imported. ``/local`` creates a party with a stand-in host and
+opens its manage page, players join through ``/local/{party_id}?name=...``
+instead of the bot's join button.
+"""
+
+import logging
+import os
+from secrets import token_urlsafe
+from zlib import crc32
+
+from litestar import Request, Router, get
+from litestar.response import Redirect
+
+from modules.types import UserProfile
+
+LOCAL_MODE = os.environ.get("BUZZER_LOCAL", "") == "1"
+
+
+def local_user(name: str) -> UserProfile:
+    # Same name, same user, so joining again gives back the same code.
+    user_id = crc32(name.encode())
+    avatar = f"https://cdn.discordapp.com/embed/avatars/{user_id % 6}.png"
+    return UserProfile(user_id, name, avatar)
+
+
+@get("/")
+async def local_create(request: Request) -> Redirect:
+    party_id = token_urlsafe(6)
+    host = UserProfile(-1, "Host", "https://cdn.discordapp.com/embed/avatars/0.png")
+    code = await request.app.state.parties.create_party(party_id, host)
+    logging.info("Created local party, join with /local/%s?name=...", party_id)
+    return Redirect(f"/host/{party_id}", query_params={"user": code})
+
+
+@get("/{party_id:str}")
+async def local_join(request: Request, party_id: str) -> Redirect:
+    name = request.query_params.get("name") or "Player"
+    code = await request.app.state.parties.join_party(party_id, local_user(name))
+    if not code:
+        return Redirect("/buzzer", query_params={"error": "1"})
+    return Redirect(f"/buzzer/{party_id}", query_params={"user": code})
+
+
+local_router = Router(path="/local", route_handlers=[local_create, local_join])
@@ -0,0 +1,219 @@
+"""Prometheus metrics, served as text on ``/metrics``.
+
+Only what this site needs: histograms are updated on the hot paths, while
+gauges and the RTT summary are computed from the party store when scraped.
+In cluster mode every worker keeps its own metrics, the proxy scrapes them
+all and serves them together with a ``worker`` label.
+"""
+
+import bisect
+from typing import Callable, Iterable
+
+from litestar import Request, get
+from litestar.response import Response
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+RTT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Iterable[float]) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {total}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, value: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.value = value
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value()}",
+        ]
+
+
+class Summary:
+    """Quantiles over values that are only known at scrape time."""
+
+    def __init__(self, name: str, help: str, values: Callable[[], list[float]]) -> None:
+        self.name = name
+        self.help = help
+        self.values = values
+
+    def render(self) -> list[str]:
+        values = sorted(self.values())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} summary"]
+        for q in RTT_QUANTILES:
+            value = (
+                values[min(len(values) - 1, int(q * len(values)))] if values else "NaN"
+            )
+            lines.append(f'{self.name}{{quantile="{q}"}} {value}')
+        lines.append(f"{self.name}_sum {sum(values)}")
+        lines.append(f"{self.name}_count {len(values)}")
+        return lines
+
+
+buzz_seconds = Histogram(
+    "buzzer_buzz_seconds", "Time spent handling a buzz.", LATENCY_BUCKETS
+)
+update_seconds = Histogram(
+    "buzzer_update_seconds", "Time spent building an update broadcast.", LATENCY_BUCKETS
+)
+send_seconds = Histogram(
+    "buzzer_send_seconds", "Time spent sending a frame to one socket.", LATENCY_BUCKETS
+)
+payload_bytes = Histogram(
+    "buzzer_payload_bytes", "Size of the frames sent to the sockets.", SIZE_BUCKETS
+)
+inbox_batch = Histogram(
+    "buzzer_inbox_batch", "Events a party applied in one batch.", BATCH_BUCKETS
+)
+dropped_frames = Counter(
+    "buzzer_dropped_frames_total", "Queued state frames replaced by a snapshot."
+)
+
+
+def party_metrics(parties) -> list:
+    def connected():
+        return sum(len(p.connections) + bool(p.host_ws) for p in parties.values())
+
+    def outboxes():
+        for p in parties.values():
+            yield from p.connections.values()
+            if p.host_ws:
+                yield p.host_ws
+
+    def rtts():
+        return [
+            c.rtt
+            for p in parties.values()
+            for c in p.connections.values()
+            if c.rtt_estimator.samples
+        ]
+
+    return [
+        Gauge("buzzer_parties", "Parties in this worker.", lambda: len(parties)),
+        Gauge("buzzer_connections", "Connected players and hosts.", connected),
+        Gauge(
+            "buzzer_outbox_frames",
+            "Frames waiting in the outboxes of all connections.",
+            lambda: sum(c.outbox_depth for c in outboxes()),
+        ),
+        Gauge(
+            "buzzer_outbox_max_frames",
+            "Frames waiting in the fullest outbox.",
+            lambda: max((c.outbox_depth for c in outboxes()), default=0),
+        ),
+        Gauge(
+            "buzzer_backlogged_connections",
+            "Connections with frames waiting in their outbox.",
+            lambda: sum(1 for c in outboxes() if c.outbox_depth),
+        ),
+        Gauge(
+            "buzzer_dropping_connections",
+            "Connections that had state frames dropped.",
+            lambda: sum(1 for c in outboxes() if c.dropped_frames),
+        ),
+        Gauge(
+            "buzzer_connection_max_dropped_frames",
+            "Most state frames dropped for a single connection.",
+            lambda: max((c.dropped_frames for c in outboxes()), default=0),
+        ),
+        Gauge(
+            "buzzer_lost_connections",
+            "Players that disconnected but may come back.",
+            lambda: sum(len(p.lost_connections) for p in parties.values()),
+        ),
+        Gauge(
+            "buzzer_viewers",
+            "Spectators watching a party.",
+            lambda: sum(len(p.spectators) for p in parties.values()),
+        ),
+        Summary("buzzer_rtt_seconds", "Smoothed round trip time of the players.", rtts),
+    ]
+
+
+def label_worker(sample: str, worker: int) -> str:
+    name, sep, rest = sample.partition("{")
+    if sep:
+        return f'{name}{{worker="{worker}",{rest}'
+    name, _, value = sample.partition(" ")
+    return f'{name}{{worker="{worker}"}} {value}'
+
+
+def merge_workers(texts: list[str]) -> str:
+    """Combines the metrics of several workers, keeping each family together."""
+    families: dict[str, tuple[list[str], list[str]]] = {}
+    for worker, text in enumerate(texts):
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = line.split(" ", 3)[2]
+                headers, _ = families.setdefault(family, ([], []))
+                if line not in headers:
+                    headers.append(line)
+            elif line and family:
+                families[family][1].append(label_worker(line, worker))
+    lines = [
+        line for headers, samples in families.values() for line in headers + samples
+    ]
+    return "\n".join(lines) + "\n"
+
+
+@get("/metrics", include_in_schema=False)
+async def serve_metrics(request: Request) -> Response:
+    lines = []
+    for metric in (
+        buzz_seconds,
+        update_seconds,
+        send_seconds,
+        payload_bytes,
+        inbox_batch,
+        dropped_frames,
+        *party_metrics(request.app.state.parties),
+    ):
+        lines.extend(metric.render())
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
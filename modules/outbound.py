@@ -0,0 +1,171 @@
+"""Paced outbound requests to discord.
+
+discord.py already waits out rate limits, but it does so in whichever
+coroutine made the request, and every request of a burst is started right
+away. When a whole server clicks Join at once that means a pile of edits to
+the same room message, all queued up on one bucket.
+
+The dispatcher runs the requests instead. Every request names the rate limit
+bucket it falls in (e.g. the channel it posts to). A bucket only has one
+request in flight, so its requests stay in order. All buckets together stay
+under GLOBAL_RATE requests per second. Requests queued under a ``key`` replace
+the one still waiting under the same key, so ten edits of a room message in a
+row become a single edit with the latest content.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+import discord
+
+from .clock import REAL_CLOCK, Clock
+
+# Discord allows 50 requests per second per bot, keep some room for the
+# interaction responses, which are sent directly.
+GLOBAL_RATE = 40.0
+MAX_ATTEMPTS = 3
+
+
+class Job:
+    def __init__(
+        self, bucket: str, call: Callable[[], Awaitable[Any]], key: str | None
+    ) -> None:
+        self.bucket = bucket
+        self.call = call
+        self.key = key
+        self.attempts = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class Dispatcher:
+    def __init__(self, rate: float = GLOBAL_RATE, clock: Clock = REAL_CLOCK) -> None:
+        self.rate = rate
+        self.clock = clock
+        self.queues: dict[str, deque[Job]] = {}
+        # Jobs still waiting, by their key.
+        self.keyed: dict[str, Job] = {}
+        self.busy: set[str] = set()
+        self.blocked_until: dict[str, float] = {}
+        self.next_send: float = 0.0
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def send(
+        self, bucket: str, call: Callable[[], Awaitable[Any]], key: str | None = None
+    ) -> asyncio.Future:
+        """Queues ``call`` and returns a future for its result.
+
+        If a job with the same ``key`` is still waiting, it is dropped in favour
+        of this one and its future gets this one's result.
+        """
+        job = Job(bucket, call, key)
+        job.future.add_done_callback(self.log_failure)
+        previous = self.keyed.get(key) if key else None
+        if previous:
+            self.queues[previous.bucket].remove(previous)
+            previous.future.remove_done_callback(self.log_failure)
+            job.future.add_done_callback(lambda f: self.chain(f, previous.future))
+        if key:
+            self.keyed[key] = job
+        self.queues.setdefault(bucket, deque()).append(job)
+        self.wakeup.set()
+        if not self.task:
+            self.task = asyncio.create_task(self.run())
+        return job.future
+
+    @staticmethod
+    def log_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logging.warning("Discord request failed", exc_info=future.exception())
+
+    @staticmethod
+    def chain(source: asyncio.Future, target: asyncio.Future):
+        if target.done():
+            return
+        if source.cancelled():
+            target.cancel()
+        elif source.exception():
+            target.set_exception(source.exception())  # type: ignore[arg-type]
+        else:
+            target.set_result(source.result())
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def next_job(self, now: float) -> Job | float | None:
+        """Pops the next job that may run, or returns when one may."""
+        wait_until = None
+        for bucket, queue in self.queues.items():
+            if not queue or bucket in self.busy:
+                continue
+            blocked = self.blocked_until.get(bucket, 0.0)
+            if blocked > now:
+                wait_until = min(wait_until or blocked, blocked)
+                continue
+            self.blocked_until.pop(bucket, None)
+            job = queue.popleft()
+            # Round robin, the bucket goes to the back of the line.
+            del self.queues[bucket]
+            if queue:
+                self.queues[bucket] = queue
+            if job.key and self.keyed.get(job.key) is job:
+                del self.keyed[job.key]
+            return job
+        return wait_until
+
+    async def run(self):
+        while True:
+            now = self.clock.now()
+            job = self.next_job(now)
+            if not isinstance(job, Job):
+                self.wakeup.clear()
+                timeout = None if job is None else job - now
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self.next_send > now:
+                await self.clock.sleep(self.next_send - now)
+            self.next_send = max(self.next_send, now) + 1 / self.rate
+            self.busy.add(job.bucket)
+            asyncio.create_task(self.execute(job))
+
+    async def execute(self, job: Job):
+        job.attempts += 1
+        try:
+            result = await job.call()
+        except Exception as e:
+            retry_after = self.retry_after(e)
+            if retry_after is not None and job.attempts < MAX_ATTEMPTS:
+                logging.warning("Rate limited on %s for %.1fs", job.bucket, retry_after)
+                self.blocked_until[job.bucket] = self.clock.now() + retry_after
+                self.queues.setdefault(job.bucket, deque()).appendleft(job)
+            elif not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.busy.discard(job.bucket)
+            self.wakeup.set()
+
+    @staticmethod
+    def retry_after(error: Exception) -> float | None:
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after
+        if isinstance(error, discord.HTTPException) and error.status == 429:
+            return float(error.response.headers.get("Retry-After", 1.0))
+        return None
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        for queue in self.queues.values():
+            for job in queue:
+                job.future.cancel()
+        self.queues.clear()
+        self.keyed.clear()
@@ -0,0 +1,90 @@
+"""Ends parties whose host has been gone for a while.
+
+Parties are kept on a timing wheel: one bucket of party ids per tick, so every
+tick only looks at the parties that may have expired by then instead of all
+of them. A party that turns out to still be in use is put back for whenever
+it could expire next.
+"""
+
+import logging
+import os
+from math import ceil
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .store import PartyStore
+
+# How long a party may go without anyone on its manage page.
+PARTY_TTL = float(os.environ.get("BUZZER_PARTY_TTL", 15 * 60))
+WHEEL_TICK = 10.0
+# How often the memory held by the parties gets logged.
+REPORT_INTERVAL = 300.0
+
+
+class TimingWheel:
+    def __init__(self, tick: float, slots: int) -> None:
+        self.tick = tick
+        self.slots: list[set[str]] = [set() for _ in range(slots)]
+        self.position: int = 0
+
+    def schedule(self, key: str, delay: float):
+        # Delays longer than one turn of the wheel come back early and get
+        # scheduled again.
+        ticks = min(max(ceil(delay / self.tick), 1), len(self.slots) - 1)
+        self.slots[(self.position + ticks) % len(self.slots)].add(key)
+
+    def advance(self) -> set[str]:
+        """Moves one tick forward and returns the keys that are due."""
+        self.position += 1
+        slot = self.position % len(self.slots)
+        due, self.slots[slot] = self.slots[slot], set()
+        return due
+
+
+class PartyReaper:
+    def __init__(
+        self, store: "PartyStore", ttl: float = PARTY_TTL, tick: float = WHEEL_TICK
+    ) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.wheel = TimingWheel(tick, ceil(ttl / tick) + 1)
+        self.last_report = store.clock.now()
+
+    def track(self, party_id: str):
+        self.wheel.schedule(party_id, self.ttl)
+
+    async def run(self):
+        while True:
+            await self.store.clock.sleep(self.wheel.tick)
+            await self.sweep()
+            if self.store.clock.now() - self.last_report >= REPORT_INTERVAL:
+                self.report()
+
+    async def sweep(self):
+        now = self.store.clock.now()
+        for party_id in self.wheel.advance():
+            # Not asked for once since it was tracked, a journaled party from
+            # a previous run is dropped without loading it.
+            party = self.store.parties.get(party_id)
+            if not party:
+                journal = self.store.journal
+                if journal and party_id in journal:
+                    logging.info("Ending idle journaled party %s", party_id)
+                    self.store.pop(party_id)
+                continue
+            if party.idle_since is None:
+                self.wheel.schedule(party_id, self.ttl)
+            elif now - party.idle_since < self.ttl:
+                self.wheel.schedule(party_id, party.idle_since + self.ttl - now)
+            else:
+                logging.info("Ending idle party %s", party_id)
+                self.store.pop(party_id)
+                await party.close()
+
+    def report(self):
+        self.last_report = self.store.clock.now()
+        usage = self.store.memory_usage()
+        total = sum(u["state_bytes"] + u["outbox_bytes"] for u in usage.values())
+        logging.info("%s parties using ~%s KiB", len(usage), total // 1024)
+        for party_id, party_usage in usage.items():
+            logging.debug("Party %s: %s", party_id, party_usage)
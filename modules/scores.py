@@ -0,0 +1,176 @@
+"""Points, penalties and the leaderboard of a party.
+
+Scores live in int columns indexed by the players' roster index, instead of
+a dict per player. The ranking is a list of ``(-points, index)`` kept sorted
+with bisect, so an award moves a single entry, and the players whose rank
+changed because of it are exactly the ones it passed, which are the only ones
+the clients hear about. A rank is one more than the amount of players with
+more points, so tied players share it.
+
+Every buzz round (up to a RESET) and every multiple choice prompt ends up in
+the round log, which is part of the export of the game.
+"""
+
+import bisect
+from array import array
+
+# Largest amount of points the host can award or take away at once.
+MAX_AWARD = 1000
+
+BUZZ = "buzz"
+MULTIPLE_CHOICE = "mc"
+
+
+class Round:
+    def __init__(self, kind: str = BUZZ, choices: list[str] | None = None) -> None:
+        self.kind = kind
+        self.choices = choices
+        self.correct: str | None = None
+        self.correct_points: int = 0
+        # Player indices in buzz order.
+        self.order = array("i")
+        # Flat (player index, choice number) and (player index, points) pairs,
+        # ``scored`` being the points given for the correct answer.
+        self.answers = array("i")
+        self.awards = array("i")
+        self.scored = array("i")
+
+    def empty(self) -> bool:
+        """Buzz rounds nobody buzzed in are left out of the log, prompts aren't."""
+        return self.kind == BUZZ and not (self.order or self.answers or self.awards)
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "choices": self.choices,
+            "correct": self.correct,
+            "correct_points": self.correct_points,
+            "order": self.order.tolist(),
+            "answers": self.answers.tolist(),
+            "awards": self.awards.tolist(),
+            "scored": self.scored.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Round":
+        round = cls(data["kind"], data["choices"])
+        round.correct = data["correct"]
+        round.correct_points = data["correct_points"]
+        round.order.extend(data["order"])
+        round.answers.extend(data["answers"])
+        round.awards.extend(data["awards"])
+        round.scored.extend(data.get("scored", []))
+        return round
+
+    def choices_by_player(self) -> dict[int, str]:
+        assert self.choices
+        answers = zip(self.answers[::2], self.answers[1::2])
+        return {index: self.choices[choice] for index, choice in answers}
+
+
+class Scoreboard:
+    def __init__(self) -> None:
+        self.points = array("i")
+        self.penalties = array("i")
+        self.ranking: list[tuple[int, int]] = []
+        self.rounds: list[Round] = []
+        self.current = Round()
+
+    def ensure(self, index: int) -> list[int]:
+        """Adds columns up to ``index``, new players start at 0 points.
+
+        Returns the players below 0, who each dropped a rank if any were added.
+        """
+        if index < len(self.points):
+            return []
+        while len(self.points) <= index:
+            bisect.insort(self.ranking, (0, len(self.points)))
+            self.points.append(0)
+            self.penalties.append(0)
+        start = bisect.bisect_left(self.ranking, (1, -1))
+        return [other for _, other in self.ranking[start:]]
+
+    def score(self, index: int) -> tuple[int, int]:
+        """The points and the rank of a player."""
+        if not 0 <= index < len(self.points):
+            return 0, self.rank_of(0)
+        return self.points[index], self.rank_of(self.points[index])
+
+    def rank_of(self, points: int) -> int:
+        return bisect.bisect_left(self.ranking, (-points, -1)) + 1
+
+    def award(
+        self, awards: dict[int, int], penalty: bool = True, round: Round | None = None
+    ) -> dict[int, int]:
+        """Adds points by player index, negative ones count as a penalty.
+
+        ``penalty`` is False when points are only taken back, ``round`` is the
+        one they are logged in, the current one by default. Returns the new
+        rank of every player whose rank changed, the awarded players
+        themselves are always included.
+        """
+        before: dict[int, int] = {}
+        for index, points in awards.items():
+            self.ensure(index)
+            old = self.points[index]
+            new = old + points
+            # Everyone from the lower score up to, not including, the higher
+            # one is passed by this player or passes it.
+            low, high = min(old, new), max(old, new)
+            start = bisect.bisect_left(self.ranking, (-high, len(self.points)))
+            end = bisect.bisect_left(self.ranking, (-low, len(self.points)))
+            for _, other in self.ranking[start:end]:
+                before.setdefault(other, self.rank_of(self.points[other]))
+            before.setdefault(index, self.rank_of(old))
+
+            del self.ranking[bisect.bisect_left(self.ranking, (-old, index))]
+            bisect.insort(self.ranking, (-new, index))
+            self.points[index] = new
+            if points < 0 and penalty:
+                self.penalties[index] -= points
+            (round or self.current).awards.extend((index, points))
+
+        ranks = {}
+        for index, rank in before.items():
+            new_rank = self.rank_of(self.points[index])
+            if new_rank != rank or index in awards:
+                ranks[index] = new_rank
+        return ranks
+
+    def choice_round(self) -> tuple[int, Round] | None:
+        """The latest multiple choice round and its position in the log.
+
+        The current round is at ``len(self.rounds)``.
+        """
+        rounds = [*self.rounds, self.current]
+        for position in reversed(range(len(rounds))):
+            if rounds[position].kind == MULTIPLE_CHOICE:
+                return position, rounds[position]
+        return None
+
+    def next_round(self, kind: str, choices: list[str] | None = None) -> Round | None:
+        """Starts a new round, returns the previous one if it went into the log."""
+        closed = self.current
+        self.current = Round(kind, choices)
+        if closed.empty():
+            return None
+        self.rounds.append(closed)
+        return closed
+
+    def dump(self) -> dict:
+        return {
+            "points": self.points.tolist(),
+            "penalties": self.penalties.tolist(),
+            "rounds": [r.to_dict() for r in self.rounds],
+            "current": self.current.to_dict(),
+        }
+
+    @classmethod
+    def restore(cls, data: dict) -> "Scoreboard":
+        scores = cls()
+        scores.points.extend(data["points"])
+        scores.penalties.extend(data["penalties"])
+        scores.ranking = sorted((-p, i) for i, p in enumerate(scores.points))
+        scores.rounds = [Round.from_dict(r) for r in data["rounds"]]
+        scores.current = Round.from_dict(data["current"])
+        return scores
@@ -0,0 +1,384 @@
+"""Plays whole quiz nights in virtual time.
+
+    python -m modules.sim --parties 4 --players 200 --rounds 30 --seed 1
+
+The buzzer and host routes run on a ``VirtualTimeLoop`` and are driven
+through ASGI by simulated clients, so no sockets are involved and an evening
+of play takes seconds. Every link has its own latency and jitter and every
+player its own clock, players reconnect now and then, hosts drop out for a
+while, and after the last round the hosts leave for good so the reaper has
+to end the parties.
+
+Every player presses at a known moment, so the buzz order can be checked
+against the order of the presses. The results are printed as JSON and are
+the same for the same seed.
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import random
+from time import perf_counter
+
+from litestar import Litestar
+
+from .bench import percentile
+from .buzzer import buzzer_router
+from .clock import LoopClock, run_virtual
+from .host import host_router
+from .reaper import PartyReaper
+from .store import PartyStore
+from .types import WS_RETRY_LATER, Party, UserProfile
+
+# Seconds of play before the first question, so the clocks get synced.
+WARMUP = 10.0
+ROUND_LENGTH = 8.0
+
+
+def inversions(ranks: list[int]) -> int:
+    """Pairs that are out of order, in O(n log n)."""
+    seen: list[int] = []
+    count = 0
+    for rank in ranks:
+        position = bisect.bisect_right(seen, rank)
+        count += len(seen) - position
+        seen.insert(position, rank)
+    return count
+
+
+class Link:
+    """One direction of a connection, delivers in order after a delay."""
+
+    def __init__(self, latency: float, jitter: float, rng: random.Random) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = rng
+        self.last: float = 0.0
+
+    def deliver(self, callback, *args):
+        loop = asyncio.get_running_loop()
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        self.last = max(self.last, loop.time() + delay)
+        loop.call_at(self.last, callback, *args)
+
+
+class SimSocket:
+    """A websocket session with the app, over a pair of links."""
+
+    def __init__(self, client: "SimClient", path: str, query: str) -> None:
+        self.client = client
+        self.to_server: asyncio.Queue[dict] = asyncio.Queue()
+        self.closed = False
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "server": ("sim", 80),
+            "client": ("sim", 0),
+            "root_path": "",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": [(b"cookie", client.cookie.encode())],
+            "subprotocols": [],
+            "state": {},
+        }
+        self.to_server.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(
+            client.sim.app(scope, self.to_server.get, self.from_server)
+        )
+
+    async def from_server(self, message: dict):
+        if self.closed:
+            return
+        if message["type"] == "websocket.send":
+            data = message.get("text") or message.get("bytes")
+            self.client.down.deliver(self.client.received, self, data)
+        elif message["type"] == "websocket.close":
+            self.closed = True
+            code = message.get("code", 1000)
+            reason = message.get("reason") or ""
+            # What a server does once the close handshake is done.
+            self.to_server.put_nowait({"type": "websocket.disconnect", "code": code})
+            self.client.down.deliver(self.client.closed, self, code, reason)
+
+    def send(self, payload: dict):
+        if not self.closed:
+            message = {"type": "websocket.receive", "text": json.dumps(payload)}
+            self.client.up.deliver(self.to_server.put_nowait, message)
+
+    def disconnect(self):
+        if not self.closed:
+            self.closed = True
+            message = {"type": "websocket.disconnect", "code": 1001}
+            self.client.up.deliver(self.to_server.put_nowait, message)
+
+
+class SimClient:
+    path = "/buzzer/ws"
+
+    def __init__(
+        self, sim: "Simulation", party_id: str, code: str, rng: random.Random
+    ) -> None:
+        self.sim = sim
+        self.code = code
+        self.cookie = f"party={party_id}; user={code}"
+        latency = rng.uniform(0.005, sim.args.latency)
+        self.up = Link(latency, latency * sim.args.jitter, rng)
+        self.down = Link(latency, latency * sim.args.jitter, rng)
+        # Nobody's clock agrees with the server's.
+        self.clock_offset = rng.uniform(-1000, 1000)
+        self.socket: SimSocket | None = None
+        self.seq: int | None = None
+        self.epoch: str | None = None
+        self.online = False
+
+    def local_time(self) -> float:
+        return asyncio.get_running_loop().time() + self.clock_offset
+
+    def connect(self):
+        self.online = True
+        query = "format=json"
+        if self.seq is not None and self.epoch:
+            query += f"&epoch={self.epoch}&seq={self.seq}"
+        self.socket = SimSocket(self, self.path, query)
+
+    def disconnect(self):
+        self.online = False
+        if self.socket:
+            self.socket.disconnect()
+
+    def received(self, socket: SimSocket, data: str):
+        if socket is not self.socket:
+            return
+        self.sim.messages += 1
+        msg = json.loads(data)
+        event = msg["event"]
+        if event == "PING":
+            socket.send({"event": "PONG", "id": msg["id"], "t": self.local_time()})
+        elif event == "UPDATE":
+            self.sim.snapshots += 1
+            self.seq, self.epoch = msg["seq"], msg.get("epoch", self.epoch)
+        elif event == "DELTA":
+            if self.seq is not None and msg["seq"] > self.seq + 1:
+                self.seq = None
+                socket.send({"event": "RESYNC"})
+            elif self.seq is not None:
+                self.seq = max(self.seq, msg["seq"])
+        else:
+            self.handle(msg)
+
+    def handle(self, msg: dict):
+        pass
+
+    def closed(self, socket: SimSocket, code: int, reason: str):
+        if socket is not self.socket or not self.online:
+            return
+        if code == WS_RETRY_LATER:
+            self.sim.deferred += 1
+            retry = int(reason.split("=")[-1]) / 1000
+            asyncio.get_running_loop().call_later(retry, self.connect)
+        else:
+            self.online = False
+
+
+class SimPlayer(SimClient):
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.pressed_at: float | None = None
+
+    def press(self):
+        if not self.socket or not self.online:
+            return
+        self.pressed_at = asyncio.get_running_loop().time()
+        self.socket.send({"event": "BUZZ", "t": self.local_time()})
+
+    def handle(self, msg: dict):
+        if msg["event"] == "BUZZ_ACK" and self.pressed_at is not None:
+            now = asyncio.get_running_loop().time()
+            self.sim.ack_latencies.append(now - self.pressed_at)
+
+
+class SimHost(SimClient):
+    path = "/host/ws"
+
+    def command(self, msg: dict):
+        if self.socket and self.online:
+            self.socket.send(msg)
+
+
+class Simulation:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.app = Litestar(
+            route_handlers=[buzzer_router, host_router], logging_config=None
+        )
+        self.store = PartyStore(self.app, clock=LoopClock())
+        self.store.reaper = PartyReaper(self.store, ttl=args.ttl)
+        self.app.state.parties = self.store
+        self.messages = 0
+        self.snapshots = 0
+        self.deferred = 0
+        self.buzzes = 0
+        self.rounds = 0
+        self.first_correct = 0
+        self.pairs = 0
+        self.inverted = 0
+        self.ack_latencies: list[float] = []
+        self.digest = hashlib.sha256()
+        self.reaped_at: dict[str, float] = {}
+
+    async def setup_party(self, n: int) -> tuple[Party, SimHost, list[SimPlayer]]:
+        party_id = f"sim-{n}"
+        code = await self.store.create_party(
+            party_id, UserProfile(n * 100_000, f"host{n}", "")
+        )
+        host = SimHost(self, party_id, code, random.Random(self.rng.random()))
+        players = []
+        for i in range(self.args.players):
+            profile = UserProfile(n * 100_000 + i + 1, f"player{n}-{i}", "")
+            code = await self.store.join_party(party_id, profile)
+            assert code
+            rng = random.Random(self.rng.random())
+            players.append(SimPlayer(self, party_id, code, rng))
+        party = self.store.get(party_id)
+        assert party
+        return party, host, players
+
+    def check_round(self, party: Party, players: list[SimPlayer]):
+        pressed = {p.code: p.pressed_at for p in players if p.pressed_at is not None}
+        order = [d.user_id for d in party.buzz_order if d.user_id in pressed]
+        self.buzzes += len(order)
+        self.rounds += 1
+        if not order:
+            return
+        by_press = sorted(order, key=pressed.__getitem__)
+        ranks = {code: rank for rank, code in enumerate(by_press)}
+        self.first_correct += order[0] == by_press[0]
+        self.pairs += len(order) * (len(order) - 1) // 2
+        self.inverted += inversions([ranks[code] for code in order])
+        numbers = {p.code: i for i, p in enumerate(players)}
+        self.digest.update(repr([numbers[code] for code in order]).encode())
+
+    async def run_party(self, party: Party, host: SimHost, players: list[SimPlayer]):
+        args = self.args
+        rng = random.Random(self.rng.random())
+        loop = asyncio.get_running_loop()
+        host.connect()
+        for player in players:
+            player.connect()
+        await asyncio.sleep(WARMUP)
+
+        for _ in range(args.rounds):
+            host.command(
+                {
+                    "event": "BATCH",
+                    "ops": [{"event": "RESET"}, {"event": "SET_LOCK", "locked": False}],
+                }
+            )
+            await asyncio.sleep(1)
+            for player in players:
+                player.pressed_at = None
+                if player.online and rng.random() < args.buzz_chance:
+                    loop.call_later(rng.lognormvariate(0, 0.35), player.press)
+            await asyncio.sleep(ROUND_LENGTH)
+            self.check_round(party, players)
+
+            for player in players:
+                if player.online and rng.random() < args.churn:
+                    player.disconnect()
+                    loop.call_later(rng.uniform(0.5, 5), player.connect)
+            if host.online and rng.random() < args.host_drops:
+                host.disconnect()
+                loop.call_later(rng.uniform(5, 60), host.connect)
+            await asyncio.sleep(1)
+
+        # The host is gone for good, the reaper has to end the party.
+        left_at = loop.time()
+        host.disconnect()
+        while self.store.get(party.id):
+            await asyncio.sleep(1)
+        self.reaped_at[party.id] = loop.time() - left_at
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+        wall = perf_counter()
+        parties = [await self.setup_party(n) for n in range(self.args.parties)]
+        self.store.start()
+        await asyncio.gather(*(self.run_party(*p) for p in parties))
+        await self.store.close()
+        virtual, wall = loop.time(), perf_counter() - wall
+
+        others = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in others:
+            task.cancel()
+        await asyncio.gather(*others, return_exceptions=True)
+
+        acks = sorted(self.ack_latencies)
+        return {
+            "config": vars(self.args),
+            "virtual_s": round(virtual, 3),
+            "wall_s": round(wall, 3),
+            "speedup": round(virtual / wall, 1),
+            "rounds": self.rounds,
+            "buzzes": self.buzzes,
+            "first_buzz_correct": round(self.first_correct / max(self.rounds, 1), 3),
+            "inverted_pairs": round(self.inverted / max(self.pairs, 1), 4),
+            "ack_ms": {
+                name: (None if value is None else round(value * 1000, 1))
+                for name, value in (
+                    ("p50", percentile(acks, 0.5)),
+                    ("p99", percentile(acks, 0.99)),
+                )
+            },
+            "messages": self.messages,
+            "snapshots": self.snapshots,
+            "deferred_connects": self.deferred,
+            "reaped_after_s": max(self.reaped_at.values(), default=None),
+            "digest": self.digest.hexdigest()[:16],
+        }
+
+
+async def simulate(args: argparse.Namespace) -> dict:
+    # The store reads the clock, so it has to be created inside the loop.
+    return await Simulation(args).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--parties", type=int, default=2)
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument(
+        "--buzz-chance", type=float, default=0.8, help="share of players buzzing"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.15, help="highest one way latency"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.5, help="jitter, relative to latency"
+    )
+    parser.add_argument(
+        "--churn", type=float, default=0.02, help="share of players reconnecting"
+    )
+    parser.add_argument(
+        "--host-drops", type=float, default=0.05, help="chance of a host dropping"
+    )
+    parser.add_argument(
+        "--ttl", type=float, default=120, help="seconds before the reaper acts"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # The admission pacing draws its jitter from the global generator.
+    random.seed(args.seed)
+    print(json.dumps(run_virtual(simulate(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
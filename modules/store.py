@@ -0,0 +1,277 @@
+"""Where the parties live.
+
+By default every party lives in this process. When running several workers
+(see ``modules.cluster``) each worker owns the parties whose id hashes to its
+shard, and reaches the other workers through their unix sockets.
+
+The discord bot may also run in a process of its own (``BUZZER_BOT=external``
+for the web tier, ``python -m modules.discord_bot`` for the bot), in which case
+it uses a ``RemotePartyStore`` that only talks to the web tier.
+"""
+
+import asyncio
+import logging
+import os
+from zlib import crc32
+
+import aiohttp
+from litestar import Litestar
+
+from .clock import REAL_CLOCK, Clock
+from .journal import JOURNAL_PATH, Journal
+from .reaper import PartyReaper
+from .types import Party, UserProfile
+
+WORKER = int(os.environ.get("BUZZER_WORKER", "0"))
+WORKERS = int(os.environ.get("BUZZER_WORKERS", "1"))
+SOCKET_DIR = os.environ.get("BUZZER_SOCKET_DIR", "/tmp")
+IPC_TOKEN = os.environ.get("BUZZER_IPC_TOKEN", "")
+IPC_HEADER = "X-Buzzer-IPC"
+# Where an external bot reaches a single web process, otherwise it uses the
+# cluster workers' sockets.
+IPC_URL = os.environ.get("BUZZER_IPC_URL", "")
+EXTERNAL_BOT = os.environ.get("BUZZER_BOT", "") == "external"
+
+
+def shard_for(party_id: str, workers: int) -> int:
+    return crc32(party_id.encode()) % workers
+
+
+def socket_path(socket_dir: str, worker: int) -> str:
+    return os.path.join(socket_dir, f"buzzer-{worker}.sock")
+
+
+class IpcClient:
+    """Calls the ``/_ipc`` routes of the worker owning a party."""
+
+    def __init__(
+        self, workers: int, socket_dir: str, token: str, url: str = ""
+    ) -> None:
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.token = token
+        self.url = url
+        self.sessions: dict[int, aiohttp.ClientSession] = {}
+
+    def session(self, worker: int) -> aiohttp.ClientSession:
+        session = self.sessions.get(worker)
+        if not session or session.closed:
+            jar = aiohttp.DummyCookieJar()
+            if self.url:
+                session = aiohttp.ClientSession(cookie_jar=jar)
+            else:
+                connector = aiohttp.UnixConnector(
+                    path=socket_path(self.socket_dir, worker)
+                )
+                session = aiohttp.ClientSession(connector=connector, cookie_jar=jar)
+            self.sessions[worker] = session
+        return session
+
+    async def call(self, party_id: str, action: str, payload: dict) -> dict:
+        worker = shard_for(party_id, self.workers)
+        base = self.url.rstrip("/") if self.url else f"http://worker-{worker}"
+        async with self.session(worker).post(
+            f"{base}/_ipc/{action}",
+            json={"party_id": party_id, **payload},
+            headers={IPC_HEADER: self.token},
+        ) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+
+class PartyStore:
+    def __init__(
+        self, app: Litestar, journal: Journal | None = None, clock: Clock = REAL_CLOCK
+    ) -> None:
+        self.app = app
+        self.clock = clock
+        self.parties: dict[str, Party] = {}
+        self.reaper = PartyReaper(self)
+        self.reaper_task: asyncio.Task | None = None
+        self.journal = journal
+        self.journal_task: asyncio.Task | None = None
+
+    def get(self, party_id: str, default: Party | None = None) -> Party | None:
+        party = self.parties.get(party_id)
+        if not party and self.journal and party_id in self.journal:
+            party = self.rehydrate(party_id)
+        return party or default
+
+    def rehydrate(self, party_id: str) -> Party | None:
+        """Brings back a party journaled by a previous run."""
+        assert self.journal
+        state = self.journal.load(party_id)
+        if state is None:
+            return None
+        party = self.parties[party_id] = Party.restore(
+            party_id, self.app, state, self.clock
+        )
+        party.journal = self.journal
+        self.reaper.track(party_id)
+        logging.info("Restored party %s", party_id)
+        return party
+
+    def dump(self, party_id: str) -> dict | None:
+        party = self.parties.get(party_id)
+        return party.dump() if party else None
+
+    def pop(self, party_id: str, default: Party | None = None) -> Party | None:
+        if self.journal:
+            self.journal.drop(party_id)
+        return self.parties.pop(party_id, default)
+
+    def values(self):
+        return self.parties.values()
+
+    def __contains__(self, party_id: str) -> bool:
+        return self.get(party_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.parties)
+
+    def owns(self, party_id: str) -> bool:
+        return True
+
+    async def create_party(self, party_id: str, host: UserProfile) -> str:
+        """Creates a party and returns the host code."""
+        party = self.parties[party_id] = Party(party_id, self.app, clock=self.clock)
+        party.journal = self.journal
+        self.reaper.track(party_id)
+        return party.add_user(host, host=True)
+
+    async def join_party(self, party_id: str, user: UserProfile) -> str | None:
+        """Returns the user's join code, or None if the party does not exist."""
+        party = self.get(party_id)
+        if not party:
+            return None
+        return party.add_user(user)
+
+    async def lookup(self, party_id: str) -> dict | None:
+        """Returns a summary of the party, or None if it does not exist."""
+        party = self.get(party_id)
+        if not party:
+            return None
+        return {
+            "id": party.id,
+            "players": len(party.connections),
+            "host_connected": party.host_ws is not None,
+        }
+
+    async def members(self, party_id: str) -> dict | None:
+        """The host's and the players' discord ids, or None without a party."""
+        party = self.get(party_id)
+        if not party or not party.host:
+            return None
+        return {"host": party.users[party.host].id, "players": party.members()}
+
+    def memory_usage(self) -> dict[str, dict[str, int]]:
+        return {
+            party_id: party.memory_usage() for party_id, party in self.parties.items()
+        }
+
+    def start(self):
+        self.reaper_task = asyncio.create_task(self.reaper.run())
+        if self.journal:
+            # Parties of a previous run expire too, unless someone asks for them.
+            for party_id in self.journal.party_ids:
+                self.reaper.track(party_id)
+            self.journal_task = asyncio.create_task(self.journal.run(self.dump))
+
+    async def close(self):
+        if self.reaper_task:
+            self.reaper_task.cancel()
+        if self.journal_task:
+            self.journal_task.cancel()
+        if self.journal:
+            await self.journal.close(self.dump)
+
+
+class ShardedPartyStore(PartyStore):
+    """Only keeps the parties of this worker's shard, forwards the rest."""
+
+    def __init__(
+        self,
+        app: Litestar,
+        worker: int,
+        workers: int,
+        socket_dir: str,
+        token: str,
+        journal: Journal | None = None,
+    ) -> None:
+        super().__init__(app, journal)
+        self.worker = worker
+        self.workers = workers
+        self.ipc = IpcClient(workers, socket_dir, token)
+
+    def owns(self, party_id: str) -> bool:
+        return shard_for(party_id, self.workers) == self.worker
+
+    async def create_party(self, party_id: str, host: UserProfile) -> str:
+        if self.owns(party_id):
+            return await super().create_party(party_id, host)
+        data = await self.ipc.call(party_id, "create", {"user": host.to_dict()})
+        return data["code"]
+
+    async def join_party(self, party_id: str, user: UserProfile) -> str | None:
+        if self.owns(party_id):
+            return await super().join_party(party_id, user)
+        data = await self.ipc.call(party_id, "join", {"user": user.to_dict()})
+        return data["code"]
+
+    async def lookup(self, party_id: str) -> dict | None:
+        if self.owns(party_id):
+            return await super().lookup(party_id)
+        data = await self.ipc.call(party_id, "lookup", {})
+        return data["party"]
+
+    async def members(self, party_id: str) -> dict | None:
+        if self.owns(party_id):
+            return await super().members(party_id)
+        data = await self.ipc.call(party_id, "members", {})
+        return data["members"]
+
+    async def close(self):
+        await super().close()
+        await self.ipc.close()
+
+
+class RemotePartyStore:
+    """What the bot uses when it runs in its own process, keeps no parties."""
+
+    def __init__(self, ipc: IpcClient) -> None:
+        self.ipc = ipc
+
+    async def create_party(self, party_id: str, host: UserProfile) -> str:
+        data = await self.ipc.call(party_id, "create", {"user": host.to_dict()})
+        return data["code"]
+
+    async def join_party(self, party_id: str, user: UserProfile) -> str | None:
+        data = await self.ipc.call(party_id, "join", {"user": user.to_dict()})
+        return data["code"]
+
+    async def lookup(self, party_id: str) -> dict | None:
+        data = await self.ipc.call(party_id, "lookup", {})
+        return data["party"]
+
+    async def members(self, party_id: str) -> dict | None:
+        data = await self.ipc.call(party_id, "members", {})
+        return data["members"]
+
+    async def close(self):
+        await self.ipc.close()
+
+
+def create_party_store(app: Litestar) -> PartyStore:
+    journal = None
+    if JOURNAL_PATH:
+        # Every worker journals the parties of its own shard.
+        path = f"{JOURNAL_PATH}.{WORKER}" if WORKERS > 1 else JOURNAL_PATH
+        journal = Journal(path)
+    if WORKERS > 1:
+        return ShardedPartyStore(app, WORKER, WORKERS, SOCKET_DIR, IPC_TOKEN, journal)
+    return PartyStore(app, journal)
@@ -1,73 +1,302 @@
 import asyncio
+import bisect
 import logging
+import random
+import sys
 from collections import deque
 from contextlib import asynccontextmanager
 from secrets import token_urlsafe
-from statistics import mean
-from time import monotonic
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable
 
-import discord
 from litestar import WebSocket as BaseWebSocket, Litestar
 from litestar import status_codes
 from litestar.exceptions import WebSocketDisconnect, WebSocketException
 from litestar.status_codes import WS_1000_NORMAL_CLOSURE
 
+from . import metrics, wire
+from .clock import REAL_CLOCK, Clock
+from .scores import BUZZ, MULTIPLE_CHOICE, Round, Scoreboard
+from .watch import Spectators
+
+if TYPE_CHECKING:
+    from .journal import Journal
+
+# How long updates are collected before being flushed to the clients, so
+# bursts of buzzes/answers result in a single broadcast.
+UPDATE_FRAME = 0.025
+
+# Upper bound for a single websocket send during a broadcast, so one stalled
+# client can't hold up everyone else in the party.
+SEND_TIMEOUT = 5.0
+
+# Amount of frames a connection may have waiting before its queued state
+# updates are collapsed into a single fresh snapshot, and how long it may stay
+# over that limit before it is disconnected as a slow consumer.
+OUTBOX_LIMIT = 32
+SLOW_CONSUMER_TIMEOUT = 15.0
+
+# Every party pings all of its players in one batch every PING_INTERVAL
+# seconds, pongs for pings older than PING_TIMEOUT are ignored.
+PING_INTERVAL = 2.0
+PING_TIMEOUT = 10.0
+
+# Buzzes are never moved back further than this when compensating for latency.
+MAX_BUZZ_COMPENSATION = 1.0
+
+# Upper bound for the host's lock on first K buzzes setting.
+MAX_LOCK_AFTER = 1000
+
+# The host gets the live multiple choice tally at most this often.
+MC_RESULTS_INTERVAL = 0.25
+
+# Recent deltas kept per party, so a client reconnecting shortly after a
+# network blip only gets what it missed instead of a full snapshot.
+RESUME_BUFFER = 256
+
+# How many players may (re)connect to a party per second, and in one burst.
+# The rest are closed with WS_RETRY_LATER and a jittered hint for when to
+# come back, which spreads reconnect waves out.
+ADMIT_RATE = 50.0
+ADMIT_BURST = 25
+RETRY_JITTER = 1.0
+WS_RETRY_LATER = 4013
+
+
+async def send_encoded(conn: "PlayerConnection", data: bytes) -> bool:
+    mode = "binary" if conn.format == wire.BINARY else "text"
+    metrics.payload_bytes.observe(len(data))
+    start = perf_counter()
+    try:
+        await asyncio.wait_for(conn.send_data(data, mode), SEND_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning("Send timed out after %ss", SEND_TIMEOUT)
+        return False
+    except Exception:
+        logging.debug("Failed to send to websocket", exc_info=True)
+        return False
+    metrics.send_seconds.observe(perf_counter() - start)
+    return True
+
+
+class UserProfile:
+    """The parts of a discord user the party needs, safe to send between workers."""
+
+    def __init__(self, id: int, display_name: str, avatar_url: str) -> None:
+        self.id = id
+        self.display_name = display_name
+        self.avatar_url = avatar_url
+
+    @classmethod
+    def from_discord(cls, user) -> "UserProfile":
+        return cls(user.id, user.display_name, user.display_avatar.url)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "display_name": self.display_name,
+            "avatar_url": self.avatar_url,
+        }
+
+
+class RttEstimator:
+    """Smoothed round trip time and jitter (RFC 6298), O(1) per sample."""
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self) -> None:
+        self.srtt: float = 0.0
+        self.rttvar: float = 0.0
+        self.samples: int = 0
+
+    def add(self, sample: float):
+        if not self.samples:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            # Clamp outliers (e.g. a backgrounded tab) once we have a baseline.
+            limit = self.srtt + 4 * self.rttvar
+            if self.samples >= 4 and sample > limit:
+                sample = limit
+            self.rttvar += self.BETA * (abs(self.srtt - sample) - self.rttvar)
+            self.srtt += self.ALPHA * (sample - self.srtt)
+        self.samples += 1
+
+
+class ClockSync:
+    """NTP style estimate of the offset between the client and server clocks.
+
+    Uses the sample with the lowest delay out of the last few pings, as that
+    one has the smallest error bound.
+    """
+
+    def __init__(self) -> None:
+        self.samples: deque[tuple[float, float]] = deque(maxlen=8)
+        self.offset: float = 0.0
+        self.uncertainty: float = 0.0
+
+    @property
+    def synced(self) -> bool:
+        return bool(self.samples)
+
+    def add(self, sent_at: float, received_at: float, client_time: float):
+        delay = received_at - sent_at
+        offset = client_time - (sent_at + received_at) / 2
+        self.samples.append((delay, offset))
+        delay, self.offset = min(self.samples)
+        self.uncertainty = delay / 2
+
+    def to_server(self, client_time: float) -> float:
+        return client_time - self.offset
+
+
+class AdmissionPacer:
+    """Token bucket for new connections, handing out spread out retry times."""
+
+    def __init__(
+        self,
+        rate: float = ADMIT_RATE,
+        burst: int = ADMIT_BURST,
+        clock: Clock = REAL_CLOCK,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens: float = burst
+        self.updated = clock.now()
+        self.next_retry: float = 0.0
+
+    def admit(self) -> float | None:
+        """Returns None if the connection may go ahead, or when to retry."""
+        now = self.clock.now()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        # Every deferred client gets its own slot after the ones before it.
+        self.next_retry = max(self.next_retry, now) + 1 / self.rate
+        return self.next_retry - now + random.uniform(0, RETRY_JITTER)
+
 
 class CrossConnectionData:
     def __init__(self, user_id: str) -> None:
         self.user_id = user_id
         self.buzzed: bool = False
         self.buzzed_at: float = 0.0
+        # How far off buzzed_at may be, in seconds.
+        self.buzz_margin: float = 0.0
+        # Whether the buzz is already in a round of the log, buzzes stay until
+        # a RESET but belong to the round they were made in.
+        self.buzz_logged: bool = False
         self.leaving: bool = False
-        self.discord_user: discord.abc.User
+        self.discord_user: UserProfile
         self.choice: str | None = None
+        # Public per-party id, the user code must never be sent to other clients.
+        self.index: int = -1
 
 
 class PlayerConnection(BaseWebSocket):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.rtt_times: deque[float] = deque(maxlen=30)
-        self._rtt: float = 0.0
-        self.sent_times: dict[str, float] = {}
+        self.rtt_estimator = RttEstimator()
+        self.clock = ClockSync()
+        self.last_pong: int = 0
 
         user_id = self.cookies.get("user")
         if not user_id:
             raise WebSocketException(detail="Unknown User")
 
         self.game_data = CrossConnectionData(user_id)
+        self.format = (
+            wire.BINARY if self.query_params.get("format") == wire.BINARY else wire.JSON
+        )
+
+        # Outbound frames as (data, kind), kind being "event", "delta" or
+        # "snapshot". A snapshot without data is built when it gets sent.
+        self.outbox: deque[tuple[bytes | None, str]] = deque()
+        self.outbox_ready = asyncio.Event()
+        self.make_snapshot: Callable[[], bytes] | None = None
+        self.dropped_frames: int = 0
+        self.over_limit_since: float | None = None
+        self.writer_task: asyncio.Task | None = None
+        # Replaced by the party's clock once connected.
+        self.party_clock: Clock = REAL_CLOCK
 
     @property
-    def rtt(self) -> float:
-        return self._rtt
+    def outbox_depth(self) -> int:
+        return len(self.outbox)
+
+    def drop_state_frames(self):
+        kept = deque(frame for frame in self.outbox if frame[1] == "event")
+        dropped = len(self.outbox) - len(kept)
+        self.dropped_frames += dropped
+        metrics.dropped_frames.inc(dropped)
+        self.outbox = kept
+
+    def enqueue(self, data: bytes | None, kind: str = "event"):
+        if self.writer_task and self.writer_task.done():
+            return
+
+        if kind == "snapshot":
+            # Whatever state is still waiting is superseded by the snapshot.
+            self.drop_state_frames()
+        self.outbox.append((data, kind))
 
-    @rtt.setter
-    def rtt(self, new: float):
-        self.rtt_times.append(new)
-        self._rtt = mean(self.rtt_times)
+        if len(self.outbox) > OUTBOX_LIMIT:
+            self.drop_state_frames()
+            self.outbox.append((None, "snapshot"))
+            now = self.party_clock.now()
+            if self.over_limit_since is None:
+                self.over_limit_since = now
+                logging.warning("Slow consumer, player %s", self.game_data.index)
+            elif now - self.over_limit_since > SLOW_CONSUMER_TIMEOUT:
+                self.outbox.clear()
+                if self.writer_task:
+                    self.writer_task.cancel()
+                asyncio.create_task(
+                    self.close(
+                        code=status_codes.WS_1013_TRY_AGAIN_LATER,
+                        reason="Your connection is too slow.",
+                    )
+                )
+                return
 
-    async def send_rtt_pings(self):
+        self.outbox_ready.set()
+
+    async def write_outbox(self):
         while True:
-            token = token_urlsafe(8)
-            now = monotonic()
-            await self.send_json({"event": "PING", "id": token})
-            self.sent_times[token] = now
+            if not self.outbox:
+                self.over_limit_since = None
+                self.outbox_ready.clear()
+                await self.outbox_ready.wait()
+                continue
+
+            data, kind = self.outbox.popleft()
+            if data is None and self.make_snapshot:
+                data = self.make_snapshot()
+            if data is not None and not await send_encoded(self, data):
+                if self.connection_state == "disconnect":
+                    return
 
-            # Check if there are any old rtt packages
-            to_remove = []
-            for token, then in self.sent_times.items():
-                if (now - then) > 10:
-                    to_remove.append(token)
+    def start_writer(self, make_snapshot: Callable[[], bytes]):
+        self.make_snapshot = make_snapshot
+        self.writer_task = asyncio.create_task(self.write_outbox())
 
-            for token in to_remove:
-                self.sent_times.pop(token, None)
+    @property
+    def rtt(self) -> float:
+        return self.rtt_estimator.srtt
 
-            await asyncio.sleep(2)
+    @property
+    def jitter(self) -> float:
+        return self.rtt_estimator.rttvar
 
-    def received_rtt_pong(self, token: str):
-        now = monotonic()
-        old = self.sent_times.pop(token, None)
-        if old:
-            self.rtt = now - old
+    async def receive_message(self) -> dict:
+        event = await self.receive()
+        if event["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(detail="disconnect event", code=event["code"])
+        return wire.decode(event.get("bytes") or event.get("text") or "")
 
     async def close(self, code: int = 1000, reason: str | None = None) -> None:
         logging.info("Closing connection with code %s", code)
@@ -75,132 +304,809 @@ class PlayerConnection(BaseWebSocket):
 
 
 class Party:
-    def __init__(self, party_id: str, app: Litestar):
+    def __init__(
+        self,
+        party_id: str,
+        app: Litestar,
+        update_frame: float = UPDATE_FRAME,
+        clock: Clock = REAL_CLOCK,
+    ):
         self.app = app
         self.id = party_id
+        self.clock = clock
         self.connections: dict[str, PlayerConnection] = {}
-        self.lost_connections: dict[str, PlayerConnection] = {}
-        self.users: dict[str, discord.abc.User] = {}
+        # Only the game state of players that disconnected is kept, not the
+        # whole websocket.
+        self.lost_connections: dict[str, CrossConnectionData] = {}
+        self.users: dict[str, UserProfile] = {}
+        # Join codes by discord user id, so joining again is a lookup.
+        self.codes: dict[int, str] = {}
         self.locked: bool = False
+        # Lock the buzzers once this many players have buzzed, 0 to never.
+        self.lock_after: int = 0
         self.host: str | None = None
-        self.host_ws: BaseWebSocket | None = None
+        self.host_ws: PlayerConnection | None = None
         self.available_choices: list[str] | None = None
         self.show_choices: bool = False
-        self.lost_host_timeout_task: asyncio.Task | None = None
+        # Since when nobody has the manage page open, the reaper ends parties
+        # that stay like this for too long.
+        self.idle_since: float | None = clock.now()
+        self.update_frame = update_frame
+        self.update_task: asyncio.Task | None = None
+        self.ping_task: asyncio.Task | None = None
+        self.ping_round: int = 0
+        self.ping_times: deque[float] = deque(maxlen=int(PING_TIMEOUT / PING_INTERVAL))
+        self.update_pending: bool = False
+        self.update_sound: bool = False
+        self.update_snapshot: bool = False
+        self.seq: int = 0
+        self.next_index: int = 0
+        # Public name/avatar entries by user code, the clients keep their own
+        # copy so rows only need to carry the id.
+        self.profiles: dict[str, dict] = {}
+        self.buzz_order: list[CrossConnectionData] = []
+        self.pending_ops: list[tuple[dict | None, dict | None]] = []
+        # Events for every player, sent right before the next update so a
+        # batch of host commands still results in a single broadcast.
+        self.pending_events: list[dict] = []
+        # Tally of the current multiple choice prompt. ``answered`` only counts
+        # the players that are connected, so it can be compared against
+        # ``connections`` to tell whether everyone has answered.
+        self.choice_counts: dict[str, int] = {}
+        self.answered: int = 0
+        self.new_answers: list[list] = []
+        self.results_task: asyncio.Task | None = None
+        self.scores = Scoreboard()
+        # Identifies this party's sequence numbers, they start over when the
+        # party is restored, so old resume requests must not match.
+        self.epoch = token_urlsafe(6)
+        self.recent: deque[tuple[int, list | None, list | None]] = deque(
+            maxlen=RESUME_BUFFER
+        )
+        self.admission = AdmissionPacer(clock=clock)
+        # Events from the sockets, applied in order by a single consumer so
+        # the handlers never interleave, as (sender, handler, args).
+        self.inbox: list[tuple[PlayerConnection | None, Callable, tuple]] = []
+        self.inbox_task: asyncio.Task | None = None
+        # Audience of /watch, kept out of connections on purpose.
+        self.spectators = Spectators(self)
+        # Set by the store when the parties are kept on disk.
+        self.journal: "Journal | None" = None
 
-    async def broadcast_to_players(self, message: dict):
-        for con in self.connections.values():
-            asyncio.create_task(con.send_json(message))
-        if self.host_ws:
-            asyncio.create_task(self.host_ws.send_json(message))
+    def add_user(self, user: UserProfile, host: bool = False) -> str:
+        """Registers a user and returns their join code, reusing an existing one."""
+        code = self.codes.get(user.id) or token_urlsafe(16)
+        self.users[code] = user
+        self.codes[user.id] = code
+        if host:
+            self.host = code
+        self.record("user", code=code, user=user.to_dict(), host=host)
+
+        conn = self.connections.get(code)
+        data = conn.game_data if conn else self.lost_connections.get(code)
+        if data and code in self.profiles:
+            self.refresh_profile(data)
+        return code
+
+    def members(self) -> dict[str, int]:
+        """Discord user ids of the players by their join code."""
+        leaving = {d.user_id for d in self.all_players if d.leaving}
+        return {
+            code: user.id
+            for code, user in self.users.items()
+            if code != self.host and code not in leaving
+        }
+
+    def record(self, kind: str, **fields):
+        """Journals a change of the party's state, if it is kept on disk."""
+        if self.journal:
+            self.journal.append(self.id, {"kind": kind, **fields})
+
+    def dump(self) -> dict:
+        """The party's state as the journal stores it."""
+        players = {
+            d.user_id: {
+                "user_id": d.user_id,
+                "index": d.index,
+                "buzzed": d.buzzed,
+                "buzzed_at": d.buzzed_at,
+                "buzz_margin": d.buzz_margin,
+                "buzz_logged": d.buzz_logged,
+                "leaving": d.leaving,
+                "choice": d.choice,
+            }
+            for d in self.all_players
+        }
+        return {
+            "users": {code: u.to_dict() for code, u in self.users.items()},
+            "host": self.host,
+            "locked": self.locked,
+            "lock_after": self.lock_after,
+            "available_choices": self.available_choices,
+            "show_choices": self.show_choices,
+            "next_index": self.next_index,
+            "players": players,
+            "scores": self.scores.dump(),
+        }
+
+    @classmethod
+    def restore(
+        cls, party_id: str, app: Litestar, state: dict, clock: Clock = REAL_CLOCK
+    ) -> "Party":
+        """Rebuilds a party from its journaled state, nobody is connected yet."""
+        party = cls(party_id, app, clock=clock)
+        party.users = {c: UserProfile(**u) for c, u in state["users"].items()}
+        party.codes = {u.id: c for c, u in party.users.items()}
+        party.host = state["host"]
+        party.locked = state["locked"]
+        party.lock_after = state.get("lock_after", 0)
+        party.available_choices = state["available_choices"]
+        party.show_choices = state["show_choices"]
+        party.next_index = state["next_index"]
+        party.choice_counts = dict.fromkeys(party.available_choices or [], 0)
+        if state.get("scores"):
+            party.scores = Scoreboard.restore(state["scores"])
+        party.scores.ensure(party.next_index - 1)
+
+        for player in state["players"].values():
+            if player["user_id"] not in party.users:
+                continue
+            data = CrossConnectionData(player["user_id"])
+            data.index = player.get("index", -1)
+            data.buzzed = player.get("buzzed", False)
+            data.buzzed_at = player.get("buzzed_at", 0.0)
+            data.buzz_margin = player.get("buzz_margin", 0.0)
+            data.buzz_logged = player.get("buzz_logged", False)
+            data.leaving = player.get("leaving", False)
+            data.choice = player.get("choice")
+            party.lost_connections[data.user_id] = data
+            if data.choice in party.choice_counts:
+                party.choice_counts[data.choice] += 1
+            user = data.discord_user = party.users[data.user_id]
+            if data.index >= 0 and not data.leaving:
+                party.profiles[data.user_id] = {
+                    "id": data.index,
+                    "name": user.display_name,
+                    "avatar": user.avatar_url,
+                }
+
+        # Buzz times come from the old process' clock, move them so they keep
+        # their order but all happened before any new buzz.
+        party.buzz_order = sorted(
+            (d for d in party.lost_connections.values() if d.buzzed),
+            key=lambda d: d.buzzed_at,
+        )
+        if party.buzz_order:
+            shift = clock.now() - party.buzz_order[-1].buzzed_at
+            for data in party.buzz_order:
+                data.buzzed_at += shift
+        return party
+
+    def refresh_profile(self, data: CrossConnectionData):
+        user = data.discord_user = self.users[data.user_id]
+        entry = {"id": data.index, "name": user.display_name, "avatar": user.avatar_url}
+        if self.profiles.get(data.user_id) != entry:
+            self.profiles[data.user_id] = entry
+            self.emit({"op": "profile", **entry})
+
+    def broadcast_to_players(self, message: dict):
+        self.pending_events.append(message)
+        self.schedule_update()
+
+    def send_events(self):
+        events, self.pending_events = self.pending_events, []
+        for message in events:
+            frame = wire.Frame(message)
+            for con in self.connections.values():
+                con.enqueue(frame.encode(con.format))
+            if self.host_ws:
+                self.host_ws.enqueue(frame.encode(self.host_ws.format))
+
+    def roster(self) -> list[CrossConnectionData]:
+        players = [d for d in self.all_players if not d.leaving]
+        return [
+            *(d for d in self.buzz_order if not d.leaving),
+            *sorted((d for d in players if not d.buzzed), key=lambda d: d.index),
+        ]
+
+    def buzz_position(self, data: CrossConnectionData) -> int:
+        return [d for d in self.buzz_order if not d.leaving].index(data)
+
+    def user_row(self, data: CrossConnectionData, choices: bool = False) -> dict:
+        points, rank = self.scores.score(data.index)
+        return {
+            "id": data.index,
+            "buzzed": data.buzzed,
+            "margin": round(data.buzz_margin * 1000) if data.buzzed else None,
+            "connected": data.user_id in self.connections,
+            "choice": data.choice if choices else None,
+            "points": points,
+            "rank": rank,
+        }
 
     def base_user_update_payload(self, sound: bool = False, choices: bool = False):
+        roster = self.roster()
         return {
             "event": "UPDATE",
+            "seq": self.seq,
+            "epoch": self.epoch,
             "sound": sound,
-            "users": [
-                {
-                    "name": c.game_data.discord_user.display_name,
-                    "avatar": c.game_data.discord_user.display_avatar.url,
-                    "buzzed": c.game_data.buzzed,
-                    "connected": c.connection_state != "disconnect",
-                    "choice": c.game_data.choice if choices else None,
-                }
-                for c in sorted(
-                    self.all_connections,
-                    key=lambda c: (c.game_data.buzzed_at == 0.0, c.game_data.buzzed_at),
-                )
-                if not c.game_data.leaving
-            ],
-            "t": monotonic(),
+            "profiles": [self.profiles[d.user_id] for d in roster],
+            "users": [self.user_row(d, choices=choices) for d in roster],
+            "t": self.clock.now(),
             "button_state": "LOCKED" if self.locked else "OPEN",
         }
 
-    async def update_buzzers(self, sound: bool = False):
-        payload = self.base_user_update_payload(sound=sound, choices=self.show_choices)
+    def player_update_fields(self, game_data: CrossConnectionData) -> dict:
+        fields: dict = {
+            "button_state": (
+                "LOCKED" if self.locked else ("BUZZED" if game_data.buzzed else "OPEN")
+            ),
+            "choice": game_data.choice,
+        }
+        if self.available_choices and not game_data.choice:
+            fields["choices"] = self.available_choices
+        return fields
 
-        if self.host_ws:
-            asyncio.create_task(
-                self.host_ws.send_json(
-                    self.base_user_update_payload(sound=sound, choices=True)
+    def snapshot(self, conn: PlayerConnection, host: bool = False) -> bytes:
+        if host:
+            payload = self.base_user_update_payload(choices=True)
+            payload["lock_after"] = self.lock_after
+        else:
+            payload = self.base_user_update_payload(choices=self.show_choices)
+            payload.update(self.player_update_fields(conn.game_data))
+        return wire.encode(payload, conn.format)
+
+    def send_snapshot(self, conn: PlayerConnection, host: bool = False):
+        conn.enqueue(self.snapshot(conn, host=host), "snapshot")
+
+    def resume(self, conn: PlayerConnection, host: bool = False) -> bool:
+        """Sends a reconnecting client the deltas it missed, if still buffered.
+
+        The client passes the epoch and seq of the last update it applied as
+        query parameters. Returns False if it needs a snapshot instead.
+        """
+        try:
+            seq = int(conn.query_params.get("seq", ""))
+        except ValueError:
+            return False
+        if conn.query_params.get("epoch") != self.epoch or seq > self.seq:
+            return False
+        missed = [entry for entry in self.recent if entry[0] > seq]
+        if len(missed) != self.seq - seq or any(e[1] is None for e in missed):
+            return False
+
+        for entry_seq, player_ops, host_ops in missed:
+            payload = {
+                "event": "DELTA",
+                "seq": entry_seq,
+                "sound": False,
+                "t": self.clock.now(),
+                "ops": host_ops if host else player_ops,
+            }
+            if host:
+                payload["button_state"] = "LOCKED" if self.locked else "OPEN"
+                payload["lock_after"] = self.lock_after
+            else:
+                payload.update(self.player_update_fields(conn.game_data))
+            conn.enqueue(wire.encode(payload, conn.format), "delta")
+        return True
+
+    async def admit(self, conn: PlayerConnection) -> bool:
+        """Paces (re)connections, closing the ones that should come back later."""
+        retry = self.admission.admit()
+        if retry is None:
+            return True
+        await conn.accept()
+        await conn.close(code=WS_RETRY_LATER, reason=f"retry={round(retry * 1000)}")
+        return False
+
+    def post(self, handler: Callable, *args, sender: PlayerConnection | None = None):
+        """Queues an event for the inbox, to be applied after the earlier ones.
+
+        Events from a ``sender`` that was replaced by a newer connection in the
+        meantime are dropped.
+        """
+        self.inbox.append((sender, handler, args))
+        if not self.inbox_task:
+            self.inbox_task = asyncio.create_task(self.process_inbox())
+
+    async def process_inbox(self):
+        try:
+            while self.inbox:
+                batch, self.inbox = self.inbox, []
+                metrics.inbox_batch.observe(len(batch))
+                for sender, handler, args in batch:
+                    if sender and not self.is_current(sender):
+                        continue
+                    try:
+                        handler(*args)
+                    except Exception:
+                        logging.exception("Failed handling %s", handler.__name__)
+                # Events that came in while applying this batch make up the
+                # next one, the update they cause goes out with the same frame.
+                await asyncio.sleep(0)
+        finally:
+            self.inbox_task = None
+
+    def is_current(self, conn: PlayerConnection) -> bool:
+        return self.connections.get(conn.game_data.user_id) is conn
+
+    def emit(self, op: dict | None, host_op: dict | None = None):
+        """Queues a roster change for the next DELTA.
+
+        ``host_op`` replaces ``op`` for the host, e.g. to include choices the
+        players can't see yet. Clients may get ops that are already part of
+        the snapshot they received on connect, so applying them must be
+        idempotent.
+        """
+        self.pending_ops.append((op, host_op or op))
+        self.schedule_update()
+
+    def update_buzzers(self, sound: bool = False, snapshot: bool = False):
+        start = perf_counter()
+        self.send_events()
+        self.seq += 1
+        ops, self.pending_ops = self.pending_ops, []
+        now = self.clock.now()
+
+        if snapshot:
+            # Build both roster variants in a single pass; the players only
+            # get to see the choices once they are revealed.
+            roster = self.roster()
+            profiles = [self.profiles[d.user_id] for d in roster]
+            host_users = [self.user_row(d, choices=True) for d in roster]
+            if self.show_choices:
+                player_users = host_users
+            else:
+                player_users = [{**u, "choice": None} for u in host_users]
+            host_payload = {
+                "event": "UPDATE",
+                "profiles": profiles,
+                "users": host_users,
+            }
+            player_payload = {
+                "event": "UPDATE",
+                "profiles": profiles,
+                "users": player_users,
+            }
+        else:
+            host_payload = {"event": "DELTA", "ops": [h for _, h in ops if h]}
+            player_payload = {"event": "DELTA", "ops": [p for p, _ in ops if p]}
+        self.recent.append(
+            (self.seq, None, None)
+            if snapshot
+            else (self.seq, player_payload["ops"], host_payload["ops"])
+        )
+
+        kind = "snapshot" if snapshot else "delta"
+        common = {"seq": self.seq, "sound": sound, "t": now}
+        player_shared = wire.Frame({**player_payload, **common})
+
+        # Most players end up with identical per-player fields, so only
+        # encode each distinct combination once.
+        tails: dict[tuple, bytes] = {}
+        for conn in self.connections.values():
+            data = conn.game_data
+            key = (conn.format, data.buzzed, data.choice)
+            if key not in tails:
+                tails[key] = wire.merge(
+                    player_shared.encode(conn.format),
+                    self.player_update_fields(data),
+                    conn.format,
                 )
+            conn.enqueue(tails[key], kind)
+
+        if self.host_ws:
+            host_payload.update(
+                common,
+                button_state="LOCKED" if self.locked else "OPEN",
+                lock_after=self.lock_after,
             )
+            self.host_ws.enqueue(wire.encode(host_payload, self.host_ws.format), kind)
+        self.spectators.mark_dirty()
+        metrics.update_seconds.observe(perf_counter() - start)
 
-        for conn in self.connections.values():
-            if not self.locked:
-                payload["button_state"] = "BUZZED" if conn.game_data.buzzed else "OPEN"
+    def schedule_update(self, sound: bool = False, snapshot: bool = False):
+        """Marks the party as dirty, the update is sent on the next frame."""
+        self.update_pending = True
+        self.update_sound = self.update_sound or sound
+        self.update_snapshot = self.update_snapshot or snapshot
+        if not self.update_task:
+            self.update_task = asyncio.create_task(self.flush_updates())
 
-            if self.available_choices and not conn.game_data.choice:
-                payload["choices"] = self.available_choices
-            payload["choice"] = conn.game_data.choice
+    async def flush_updates(self):
+        try:
+            while self.update_pending:
+                await self.clock.sleep(self.update_frame)
+                sound, snapshot = self.update_sound, self.update_snapshot
+                self.update_pending = False
+                self.update_sound = False
+                self.update_snapshot = False
+                self.update_buzzers(sound=sound, snapshot=snapshot)
+        finally:
+            self.update_task = None
 
-            try:
-                await conn.send_json(payload)
-            except WebSocketException:
-                pass
+    async def send_pings(self):
+        try:
+            while self.connections:
+                self.ping_round += 1
+                self.ping_times.append(self.clock.now())
+                pings: dict[str, bytes] = {}
+                for conn in self.connections.values():
+                    if conn.format not in pings:
+                        pings[conn.format] = wire.encode_ping(
+                            self.ping_round, conn.format
+                        )
+                    conn.enqueue(pings[conn.format])
+                await self.clock.sleep(PING_INTERVAL)
+        finally:
+            self.ping_task = None
+
+    def received_pong(
+        self,
+        conn: PlayerConnection,
+        token: str | None,
+        client_time: float | None = None,
+    ):
+        try:
+            ping_round = int(token or "")
+        except ValueError:
+            return
+        # Rounds older than the ones we still remember have expired.
+        age = self.ping_round - ping_round
+        if ping_round <= conn.last_pong or not 0 <= age < len(self.ping_times):
+            return
+        conn.last_pong = ping_round
+        now = self.clock.now()
+        sent_at = self.ping_times[-1 - age]
+        conn.rtt_estimator.add(now - sent_at)
+        if isinstance(client_time, (int, float)):
+            conn.clock.add(sent_at, now, client_time)
 
     @property
-    def all_connections(self):
-        return [*self.connections.values(), *self.lost_connections.values()]
-
-    async def reset_buzzers(self):
-        for conn in self.all_connections:
-            conn.game_data.buzzed = False
-            conn.game_data.buzzed_at = 0.0
-        await self.update_buzzers()
-
-    def player_buzz(self, socket: PlayerConnection):
-        print("buzz: RTT", socket.rtt)
-        time = monotonic() - min(socket.rtt, 1)
+    def all_players(self) -> list[CrossConnectionData]:
+        return [
+            *(c.game_data for c in self.connections.values()),
+            *self.lost_connections.values(),
+        ]
+
+    def fill_round(self, round: Round):
+        """Adds the new buzzes and the answers so far to the current round."""
+        round.order.extend(
+            d.index for d in self.buzz_order if d.index >= 0 and not d.buzz_logged
+        )
+        if round.choices:
+            for data in self.all_players:
+                if data.index >= 0 and data.choice in round.choices:
+                    round.answers.extend((data.index, round.choices.index(data.choice)))
+
+    def next_round(self, kind: str, choices: list[str] | None = None):
+        """Puts the current round into the log and starts the next one."""
+        self.fill_round(self.scores.current)
+        for data in self.buzz_order:
+            data.buzz_logged = data.index >= 0
+        closed = self.scores.next_round(kind, choices)
+        self.record(
+            "round",
+            round=closed.to_dict() if closed else None,
+            next=self.scores.current.to_dict(),
+        )
+
+    def award(
+        self, awards: dict[int, int], penalty: bool = True, position: int | None = None
+    ):
+        """Adds points by player index, negative ones being penalties.
+
+        ``position`` is the round in the log the points belong to, if it isn't
+        the current one.
+        """
+        awards = {i: p for i, p in awards.items() if 0 <= i < self.next_index and p}
+        if not awards:
+            return
+        round = None if position is None else self.scores.rounds[position]
+        ranks = self.scores.award(awards, penalty=penalty, round=round)
+        self.record(
+            "award",
+            awards=[x for pair in awards.items() for x in pair],
+            penalty=penalty,
+            position=position,
+        )
+        for index, rank in ranks.items():
+            if index in awards:
+                points = self.scores.points[index]
+                self.emit({"op": "score", "id": index, "points": points, "rank": rank})
+            else:
+                self.emit({"op": "rank", "id": index, "rank": rank})
+
+    def mark_correct(self, choice: str, points: int):
+        """Scores the answers of the latest multiple choice round.
+
+        That may already be in the log, e.g. after a RESET. Marking again
+        first takes back exactly the points the previous mark gave. Players
+        answering correctly after the mark get their points when they answer.
+        """
+        found = self.scores.choice_round()
+        if not found or choice not in (found[1].choices or []):
+            return
+        position, round = found
+        if round is self.scores.current:
+            answers = {
+                d.index: d.choice
+                for d in self.all_players
+                if d.index >= 0 and d.choice in round.choices
+            }
+        else:
+            answers = round.choices_by_player()
+
+        awards: dict[int, int] = {}
+        for index, scored in zip(round.scored[::2], round.scored[1::2]):
+            awards[index] = awards.get(index, 0) - scored
+        del round.scored[:]
+        for index, answer in answers.items():
+            if answer == choice:
+                awards[index] = awards.get(index, 0) + points
+                round.scored.extend((index, points))
+        round.correct, round.correct_points = choice, points
+        self.record_correct(position, round)
+        in_log = position if round is not self.scores.current else None
+        self.award(awards, penalty=False, position=in_log)
+
+    def record_correct(self, position: int, round: Round):
+        self.record(
+            "correct",
+            position=position,
+            choice=round.correct,
+            points=round.correct_points,
+            scored=round.scored.tolist(),
+        )
+
+    def export(self) -> dict:
+        """The whole game so far, players by rank and the round log."""
+        players = []
+        for data in self.all_players:
+            if data.index < 0:
+                continue
+            user = self.users[data.user_id]
+            points, rank = self.scores.score(data.index)
+            penalties = self.scores.penalties
+            players.append(
+                {
+                    "id": data.index,
+                    "discord_id": user.id,
+                    "name": user.display_name,
+                    "points": points,
+                    "penalties": (
+                        penalties[data.index] if data.index < len(penalties) else 0
+                    ),
+                    "rank": rank,
+                    "left": data.leaving,
+                }
+            )
+        current = Round.from_dict(self.scores.current.to_dict())
+        self.fill_round(current)
+        rounds = [*self.scores.rounds, *([] if current.empty() else [current])]
+        return {
+            "party": self.id,
+            "players": sorted(players, key=lambda p: (p["rank"], p["id"])),
+            "rounds": [r.to_dict() for r in rounds],
+        }
+
+    def reset_buzzers(self):
+        if not self.available_choices:
+            self.next_round(BUZZ)
+        for data in self.all_players:
+            data.buzzed = False
+            data.buzzed_at = 0.0
+            data.buzz_logged = False
+        self.buzz_order.clear()
+        self.record("reset")
+        self.emit({"op": "reset"})
+
+    def toggle_lock(self):
+        self.set_lock(not self.locked)
+
+    def set_lock(self, locked: bool):
+        if locked != self.locked:
+            self.locked = locked
+            self.record("lock", locked=locked)
+        self.schedule_update()
+
+    def set_lock_after(self, count: int):
+        self.lock_after = max(0, min(count, MAX_LOCK_AFTER))
+        self.record("lock_after", count=self.lock_after)
+        self.schedule_update()
+
+    def lock_on_buzz(self):
+        """Locks as soon as enough players buzzed, within the same inbox event.
+
+        The players that haven't buzzed get a bare LOCK right away, the rest of
+        the state follows with the next update.
+        """
+        self.locked = True
+        self.record("lock", locked=True)
+        locks: dict[str, bytes] = {}
+        for conn in self.connections.values():
+            if conn.game_data.buzzed:
+                continue
+            if conn.format not in locks:
+                locks[conn.format] = wire.encode_lock(conn.format)
+            conn.enqueue(locks[conn.format])
+        self.schedule_update()
+
+    def buzz_time(
+        self, socket: PlayerConnection, client_time: float | None, now: float
+    ) -> tuple[float, float]:
+        """Estimates when the buzzer was pressed, in server time, and the margin.
+
+        ``now`` is when the buzz was received, not when it got applied.
+        """
+        window = min(socket.rtt + 4 * socket.jitter, MAX_BUZZ_COMPENSATION)
+        if isinstance(client_time, (int, float)) and socket.clock.synced:
+            pressed = socket.clock.to_server(client_time)
+            margin = socket.clock.uncertainty
+            if now - window - margin <= pressed <= now + margin:
+                return min(max(pressed, now - window), now), margin
+            # Out of bounds, the client clock jumped or the timestamp is forged.
+            return min(max(pressed, now - window), now), window
+
+        # Without a usable timestamp assume the press was half a round trip ago.
+        return now - min(socket.rtt / 2, MAX_BUZZ_COMPENSATION), window
+
+    def player_buzz(
+        self,
+        socket: PlayerConnection,
+        client_time: float | None = None,
+        received_at: float | None = None,
+    ):
+        start = perf_counter()
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(
+                "Buzz in %s from player %s, RTT %.1fms",
+                self.id,
+                socket.game_data.index,
+                socket.rtt * 1000,
+                extra={"party": self.id, "rtt": socket.rtt, "jitter": socket.jitter},
+            )
         if not socket.game_data.buzzed and not self.locked:
+            received_at = received_at or self.clock.now()
+            time, margin = self.buzz_time(socket, client_time, received_at)
             socket.game_data.buzzed = True
             socket.game_data.buzzed_at = time
-            asyncio.create_task(self.update_buzzers(sound=True))
+            socket.game_data.buzz_margin = margin
+            self.record("buzz", id=socket.game_data.user_id, at=time, margin=margin)
+            bisect.insort(self.buzz_order, socket.game_data, key=lambda d: d.buzzed_at)
+            position = self.buzz_position(socket.game_data)
+            # The buzzing player hears back right away instead of waiting for
+            # the roster update, which may reach them after everyone else.
+            socket.enqueue(wire.encode_buzz_ack(received_at, position, socket.format))
+            self.emit(
+                {
+                    "op": "buzz",
+                    "id": socket.game_data.index,
+                    "position": position,
+                    "margin": round(margin * 1000),
+                }
+            )
+            self.schedule_update(sound=True)
+            if self.lock_after and len(self.buzz_order) >= self.lock_after:
+                self.lock_on_buzz()
+        metrics.buzz_seconds.observe(perf_counter() - start)
 
-    async def prompt_multiple_choice(self, choices: list[str]):
+    def prompt_multiple_choice(self, choices: list[str]):
+        self.next_round(MULTIPLE_CHOICE, choices)
         self.available_choices = choices
         self.locked = True
         self.show_choices = False
+        self.reset_choices(choices)
+        self.record("prompt", choices=choices)
 
-        for conn in self.all_connections:
-            conn.game_data.choice = None
+        self.schedule_update(snapshot=True)
+        self.broadcast_to_players({"event": "MULTIPLE_CHOICE", "choices": choices})
+        self.schedule_results()
 
-        await self.update_buzzers()
-        await self.broadcast_to_players(
-            {"event": "MULTIPLE_CHOICE", "choices": choices}
-        )
+    def clear_multiple_choice(self):
+        self.next_round(BUZZ)
+        self.available_choices = None
+        self.show_choices = False
+        self.reset_choices([])
+        self.record("clear_mc")
+        self.schedule_update(snapshot=True)
 
-    async def received_mc_answer(self, socket: PlayerConnection, choice: str):
-        if not self.available_choices:
+    def reset_choices(self, choices: list[str]):
+        for data in self.all_players:
+            data.choice = None
+        self.choice_counts = dict.fromkeys(choices, 0)
+        self.answered = 0
+        self.new_answers.clear()
+
+    def has_answered(self, data: CrossConnectionData) -> bool:
+        return bool(self.available_choices) and data.choice in self.choice_counts
+
+    def received_mc_answer(self, socket: PlayerConnection, choice: str):
+        data = socket.game_data
+        if not self.available_choices or self.has_answered(data):
             return
-        if socket.game_data.choice in self.available_choices:
+        if choice not in self.choice_counts:
             return
-        if choice not in self.available_choices:
+        data.choice = choice
+        self.choice_counts[choice] += 1
+        self.answered += 1
+        self.record("answer", id=data.user_id, choice=choice)
+
+        # Until the results are revealed only the player itself and the host
+        # get to know about the answer.
+        socket.enqueue(
+            wire.encode({"event": "MC_ACK", "choice": choice}, socket.format)
+        )
+        if self.show_choices:
+            self.emit({"op": "choice", "id": data.index, "choice": choice})
+        else:
+            self.new_answers.append([data.index, choice])
+            self.schedule_results()
+
+        # Answered after the host already marked the correct choice.
+        round = self.scores.current
+        if round.correct == choice and round.correct_points and data.index >= 0:
+            round.scored.extend((data.index, round.correct_points))
+            self.record_correct(len(self.scores.rounds), round)
+            self.award({data.index: round.correct_points}, penalty=False)
+        self.check_all_answered()
+
+    def check_all_answered(self):
+        if self.show_choices or not self.available_choices or not self.connections:
             return
-        socket.game_data.choice = choice
-        if all(
-            c.game_data.choice in self.available_choices
-            for c in self.connections.values()
-        ):
-            self.show_choices = True
-        await self.update_buzzers()
-
-    async def end_multiple_choice(self):
+        if self.answered == len(self.connections):
+            self.reveal_results()
+
+    def reveal_results(self):
         self.show_choices = True
+        self.record("reveal")
+        self.broadcast_to_players(self.mc_results())
+        self.schedule_update(snapshot=True)
+
+    def mc_results(self) -> dict:
+        answers, self.new_answers = self.new_answers, []
+        return {
+            "event": "MC_RESULTS",
+            "choices": list(self.choice_counts),
+            "counts": list(self.choice_counts.values()),
+            "answered": self.answered,
+            "players": len(self.connections),
+            "answers": answers,
+        }
+
+    def schedule_results(self):
+        """Sends the host the live tally, at most every MC_RESULTS_INTERVAL."""
+        if not self.results_task:
+            self.results_task = asyncio.create_task(self.flush_results())
+
+    async def flush_results(self):
+        try:
+            await self.clock.sleep(MC_RESULTS_INTERVAL)
+            results = self.mc_results()
+            if self.host_ws and self.available_choices:
+                self.host_ws.enqueue(wire.encode(results, self.host_ws.format))
+        finally:
+            self.results_task = None
+
+    def end_multiple_choice(self):
+        if self.available_choices:
+            self.reveal_results()
         self.available_choices = None
-        await self.broadcast_to_players({"event": "END_MULTIPLE_CHOICE"})
-        await self.update_buzzers()
+        self.record("end_mc")
+        self.broadcast_to_players({"event": "END_MULTIPLE_CHOICE"})
+        self.schedule_update(snapshot=True)
 
     @asynccontextmanager
     async def connection(self, conn: PlayerConnection):
         logging.info("New connection from %s", conn.game_data.user_id)
-        conn.game_data.discord_user = self.users[conn.game_data.user_id]
+        if conn.game_data.user_id not in self.users:
+            raise WebSocketException(detail="Unknown User")
         await conn.accept()
-        task = None
 
         try:
-            previous_conn = self.connections.pop(conn.game_data.user_id, None)
-            self.connections[conn.game_data.user_id] = conn
+            previous_conn = self.connections.get(conn.game_data.user_id)
             logging.info(
                 "Previous Connection: %s %s", previous_conn, conn.game_data.user_id
             )
@@ -213,65 +1119,152 @@ class Party:
                 except Exception:
                     logging.error("Failed to close old connection.")
 
-                conn.game_data = previous_conn.game_data
-
-            # Restrore previous state
-            old_connection = self.lost_connections.pop(conn.game_data.user_id, None)
-            if old_connection:
-                conn.game_data = old_connection.game_data
-                conn.game_data.leaving = False
-
-            payload = self.base_user_update_payload()
-            if not self.locked:
-                payload["button_state"] = "BUZZED" if conn.game_data.buzzed else "OPEN"
-
-            await conn.send_json(payload)
-            task = asyncio.create_task(conn.send_rtt_pings())
+            self.post(self.player_connected, conn)
             yield
         except WebSocketDisconnect:
             pass
         finally:
-            self.connections.pop(conn.game_data.user_id, None)
-            self.lost_connections[conn.game_data.user_id] = conn
+            self.post(self.player_disconnected, conn)
 
-            if conn.game_data.leaving:
-                await self.update_buzzers()
+    def player_connected(self, conn: PlayerConnection):
+        previous_conn = self.connections.pop(conn.game_data.user_id, None)
+        self.connections[conn.game_data.user_id] = conn
+        if previous_conn:
+            conn.game_data = previous_conn.game_data
 
-            if task:
-                task.cancel()
+        # Restrore previous state
+        old_data = self.lost_connections.pop(conn.game_data.user_id, None)
+        if old_data:
+            conn.game_data = old_data
+            conn.game_data.leaving = False
 
-    async def lost_host_connection(self):
-        await asyncio.sleep(300)
+        data = conn.game_data
+        if not previous_conn and self.has_answered(data):
+            self.answered += 1
+        if data.index < 0:
+            data.index = self.next_index
+            self.next_index += 1
+            self.record("player", id=data.user_id, index=data.index)
+        # On the board from the start, so everyone's rank counts them.
+        for index in self.scores.ensure(data.index):
+            self.emit({"op": "rank", "id": index, "rank": self.scores.score(index)[1]})
+        self.refresh_profile(data)
+        op = {"op": "join", "user": self.user_row(data, self.show_choices)}
+        host_op = {"op": "join", "user": self.user_row(data, choices=True)}
+        if data.buzzed:
+            op["position"] = host_op["position"] = self.buzz_position(data)
+        self.emit(op, host_op=host_op)
 
-        self.app.state.parties.pop(self.id, None)
+        conn.party_clock = self.clock
+        conn.start_writer(lambda: self.snapshot(conn))
+        if not self.resume(conn):
+            self.send_snapshot(conn)
+        if not self.ping_task:
+            self.ping_task = asyncio.create_task(self.send_pings())
 
-        for conn in self.connections.values():
+    def player_left(self, conn: PlayerConnection):
+        conn.game_data.leaving = True
+
+    def player_disconnected(self, conn: PlayerConnection):
+        # A newer connection from the same user may have replaced us already.
+        if self.is_current(conn):
+            self.connections.pop(conn.game_data.user_id)
+            self.lost_connections[conn.game_data.user_id] = conn.game_data
+            if self.has_answered(conn.game_data):
+                self.answered -= 1
+
+            if conn.game_data.leaving:
+                self.record("leave", id=conn.game_data.user_id)
+                self.profiles.pop(conn.game_data.user_id, None)
+                self.emit({"op": "leave", "id": conn.game_data.index})
+            else:
+                self.emit(
+                    {
+                        "op": "connected",
+                        "id": conn.game_data.index,
+                        "connected": False,
+                    }
+                )
+            if self.available_choices:
+                self.check_all_answered()
+                self.schedule_results()
+
+        if conn.writer_task:
+            conn.writer_task.cancel()
+
+    async def close(self):
+        """Ends the party, disconnecting everyone that is still around."""
+        tasks = (self.inbox_task, self.update_task, self.ping_task, self.results_task)
+        for task in tasks:
+            if task:
+                task.cancel()
+        conns = [*self.connections.values()]
+        if self.host_ws:
+            conns.append(self.host_ws)
+        for conn in conns:
             try:
                 await conn.close()
             except Exception:
                 logging.info("Could not close connection")
-                pass
+        await self.spectators.close()
+
+    def memory_usage(self) -> dict[str, int]:
+        """Rough amount of memory held by the party, in bytes."""
+        conns = [*self.connections.values()]
+        if self.host_ws:
+            conns.append(self.host_ws)
+        containers = (
+            self.connections,
+            self.lost_connections,
+            self.users,
+            self.codes,
+            self.profiles,
+            self.buzz_order,
+            self.pending_ops,
+            self.pending_events,
+            self.inbox,
+            self.choice_counts,
+            self.new_answers,
+            self.scores.points,
+            self.scores.penalties,
+            self.scores.ranking,
+        )
+        state = sum(sys.getsizeof(c) for c in containers)
+        state += sum(sys.getsizeof(vars(d)) for d in self.all_players)
+        state += sum(sys.getsizeof(vars(u)) for u in self.users.values())
+        state += sum(sys.getsizeof(p) for p in self.profiles.values())
+        return {
+            "connections": len(conns),
+            "lost_connections": len(self.lost_connections),
+            "viewers": len(self.spectators),
+            "state_bytes": state,
+            "outbox_bytes": sum(len(d) for c in conns for d, _ in c.outbox if d),
+        }
 
     @asynccontextmanager
-    async def host_connection(self, conn: BaseWebSocket):
+    async def host_connection(self, conn: PlayerConnection):
         await conn.accept()
         if self.host_ws:
             try:
                 await self.host_ws.close()
             except WebSocketException:
                 pass
-        if self.lost_host_timeout_task:
-            self.lost_host_timeout_task.cancel()
-            self.lost_host_timeout_task = None
 
         try:
             self.host_ws = conn
+            self.idle_since = None
 
-            payload = self.base_user_update_payload(choices=True)
-            await conn.send_json(payload)
+            conn.party_clock = self.clock
+            conn.start_writer(lambda: self.snapshot(conn, host=True))
+            self.send_snapshot(conn, host=True)
+            if self.available_choices:
+                self.schedule_results()
             yield
         except WebSocketDisconnect:
-            self.lost_host_timeout_task = asyncio.create_task(
-                self.lost_host_connection()
-            )
             pass
+        finally:
+            if self.host_ws is conn:
+                self.host_ws = None
+                self.idle_since = self.clock.now()
+            if conn.writer_task:
+                conn.writer_task.cancel()
@@ -0,0 +1,154 @@
+"""Read-only audience view of a party, e.g. for streaming a quiz night.
+
+Viewers live apart from the players: the party only marks its spectators as
+dirty when it sends an update, and their own loop encodes the public state
+once per frame and hands the same bytes to every viewer. A viewer only ever
+holds the latest frame, so a slow one skips frames instead of queueing them,
+and ``?fps=N`` lowers its frame rate further.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from litestar import Request, Router, WebSocket, get, websocket
+from litestar.exceptions import WebSocketDisconnect
+from litestar.response import Redirect, Response
+from litestar.serialization import encode_json
+
+from .clock import Clock
+
+if TYPE_CHECKING:
+    from .types import Party
+
+# Viewers get at most this many frames per second.
+WATCH_FPS = 10
+SEND_TIMEOUT = 5.0
+
+
+def watch_state(party: "Party") -> dict:
+    """What the audience gets to see, never more than the players do."""
+    roster = party.roster()
+    state = {
+        "event": "WATCH",
+        "locked": party.locked,
+        "users": [
+            {
+                **party.profiles[d.user_id],
+                **party.user_row(d, choices=party.show_choices),
+            }
+            for d in roster
+        ],
+    }
+    if party.show_choices and party.choice_counts:
+        state["results"] = {
+            "choices": list(party.choice_counts),
+            "counts": list(party.choice_counts.values()),
+        }
+    return state
+
+
+class Viewer:
+    def __init__(self, socket: WebSocket, fps: float, clock: Clock) -> None:
+        self.socket = socket
+        self.clock = clock
+        self.interval = 1 / min(fps, WATCH_FPS)
+        self.frame: bytes | None = None
+        self.ready = asyncio.Event()
+
+    def offer(self, frame: bytes):
+        self.frame = frame
+        self.ready.set()
+
+    async def write(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            frame, sent_at = self.frame, self.clock.now()
+            try:
+                await asyncio.wait_for(
+                    self.socket.send_data(frame, "text"), SEND_TIMEOUT
+                )
+            except Exception:
+                logging.debug("Failed to send to viewer", exc_info=True)
+                return
+            await self.clock.sleep(self.interval - (self.clock.now() - sent_at))
+
+
+class Spectators:
+    def __init__(self, party: "Party") -> None:
+        self.party = party
+        self.viewers: set[Viewer] = set()
+        self.frame: bytes | None = None
+        self.dirty = False
+        self.task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.viewers)
+
+    def mark_dirty(self):
+        if not self.viewers:
+            # Nobody to send it to, the next viewer gets a fresh frame instead.
+            self.frame = None
+            return
+        self.dirty = True
+        if not self.task:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        try:
+            while self.dirty and self.viewers:
+                await self.party.clock.sleep(1 / WATCH_FPS)
+                self.dirty = False
+                self.frame = encode_json(watch_state(self.party))
+                for viewer in self.viewers:
+                    viewer.offer(self.frame)
+        finally:
+            self.task = None
+
+    async def watch(self, socket: WebSocket, fps: float):
+        viewer = Viewer(socket, fps, self.party.clock)
+        self.viewers.add(viewer)
+        viewer.offer(self.frame or encode_json(watch_state(self.party)))
+        writer = asyncio.create_task(viewer.write())
+        try:
+            while True:
+                # Viewers have nothing to say, this only notices them leaving.
+                await socket.receive_data("text")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            writer.cancel()
+
+    async def close(self):
+        for viewer in list(self.viewers):
+            try:
+                await viewer.socket.close()
+            except Exception:
+                logging.info("Could not close viewer")
+
+
+@websocket("/{party_id:str}/ws")
+async def watch_ws(socket: WebSocket, party_id: str) -> None:
+    party: Party | None = socket.app.state.parties.get(party_id)
+    await socket.accept()
+    if not party:
+        await socket.close(code=1000, reason="No such party.")
+        return
+    try:
+        fps = float(socket.query_params.get("fps", WATCH_FPS))
+    except ValueError:
+        fps = WATCH_FPS
+    await party.spectators.watch(socket, max(fps, 0.1))
+
+
+@get("/{party_id:str}")
+async def watch(request: Request, party_id: str) -> Response | Redirect:
+    if not request.app.state.parties.get(party_id):
+        return Redirect("/buzzer", query_params={"error": "1"})
+    # The page is the same for every party, watch.js reads the id from the URL.
+    return request.app.state.pages.response(request, "watch.html")
+
+
+watch_router = Router(path="/watch", route_handlers=[watch, watch_ws])
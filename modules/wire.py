@@ -0,0 +1,108 @@
+"""Wire formats of the websocket messages.
+
+Clients get JSON by default. Connecting with ``?format=binary`` switches the
+server to MessagePack for everything it sends, and to fixed binary layouts for
+the hottest messages: PING, BUZZ_ACK and LOCK from the server, PONG and BUZZ
+from the client.
+"""
+
+import struct
+
+import msgspec
+from litestar.serialization import decode_json, encode_json
+
+JSON = "json"
+BINARY = "binary"
+
+# First byte of the fixed layout messages. MessagePack messages always start
+# with a map header, so they can't be confused with these.
+PING = 0x01
+PONG = 0x02
+BUZZ = 0x03
+BUZZ_ACK = 0x04
+LOCK = 0x05
+
+PING_LAYOUT = struct.Struct("!BI")  # kind, ping round
+PONG_LAYOUT = struct.Struct("!BId")  # kind, ping round, client time
+BUZZ_LAYOUT = struct.Struct("!Bd")  # kind, client time
+BUZZ_ACK_LAYOUT = struct.Struct("!BdH")  # kind, server receive time, position
+
+msgpack_encoder = msgspec.msgpack.Encoder()
+
+
+def encode(payload: dict, format: str) -> bytes:
+    if format == BINARY:
+        return msgpack_encoder.encode(payload)
+    return encode_json(payload)
+
+
+def encode_ping(ping_round: int, format: str) -> bytes:
+    if format == BINARY:
+        return PING_LAYOUT.pack(PING, ping_round)
+    return encode_json({"event": "PING", "id": str(ping_round)})
+
+
+def encode_buzz_ack(received_at: float, position: int, format: str) -> bytes:
+    if format == BINARY:
+        return BUZZ_ACK_LAYOUT.pack(BUZZ_ACK, received_at, position)
+    return encode_json({"event": "BUZZ_ACK", "t": received_at, "position": position})
+
+
+def encode_lock(format: str) -> bytes:
+    if format == BINARY:
+        return bytes([LOCK])
+    return encode_json({"event": "LOCK"})
+
+
+def msgpack_map_header(data: bytes) -> tuple[int, int]:
+    """Returns the amount of entries and the header size of an encoded map."""
+    if 0x80 <= data[0] <= 0x8F:
+        return data[0] & 0x0F, 1
+    if data[0] == 0xDE:
+        return struct.unpack_from("!H", data, 1)[0], 3
+    if data[0] == 0xDF:
+        return struct.unpack_from("!I", data, 1)[0], 5
+    raise ValueError("Not a MessagePack map")
+
+
+def merge(shared: bytes, extra: dict, format: str) -> bytes:
+    """Adds the keys of ``extra`` to an already encoded object."""
+    if format == BINARY:
+        count, start = msgpack_map_header(shared)
+        tail = msgpack_encoder.encode(extra)
+        extra_count, extra_start = msgpack_map_header(tail)
+        count += extra_count
+        if count <= 0x0F:
+            header = bytes([0x80 | count])
+        elif count <= 0xFFFF:
+            header = struct.pack("!BH", 0xDE, count)
+        else:
+            header = struct.pack("!BI", 0xDF, count)
+        return header + shared[start:] + tail[extra_start:]
+    return shared[:-1] + b"," + encode_json(extra)[1:]
+
+
+def decode(data: str | bytes) -> dict:
+    """Decodes a client message into the same dict the JSON one would give."""
+    if isinstance(data, str):
+        return decode_json(data)
+    if data[:1] == bytes([PONG]):
+        _, ping_round, client_time = PONG_LAYOUT.unpack(data)
+        return {"event": "PONG", "id": str(ping_round), "t": client_time}
+    if data[:1] == bytes([BUZZ]):
+        _, client_time = BUZZ_LAYOUT.unpack(data)
+        return {"event": "BUZZ", "t": client_time}
+    return decode_json(data)
+
+
+class Frame:
+    """A message to send to many connections, encoded at most once per format."""
+
+    def __init__(self, payload: dict) -> None:
+        self.payload = payload
+        self.encoded: dict[str, bytes] = {}
+
+    def encode(self, format: str) -> bytes:
+        if format not in self.encoded:
+            self.encoded[format] = encode(self.payload, format)
+        return self.encoded[format]
@@ -1,16 +1,29 @@
+import { Roster, RosterList, renderResults, renderScore } from "./roster.js";
+import { FORMAT, decodeMessage, encodeBuzz, encodePong } from "./wire.js";
+import { Sound } from "./sound.js";
+
 const buzzer_button = document.getElementById("buzz");
 const message_box = document.getElementById("message");
 const audioToggle = document.getElementById("audio")
+const buzzerSound = new Sound("/static/buzz.wav", 0.2)
 
 var send = (event, data = {}) => { }
+var sendFrame = (data) => { }
 var buzzer_state = "OPEN";
+var buzz_position = null;
+var retries = 0;
+const roster = new Roster();
+const rosterList = new RosterList(document.getElementById("buzzed-users"), renderRow);
 
 function connectWs() {
 
     const proto = location.protocol === "https:" ? "wss" : "ws";
-    const buzzer_ws = new WebSocket(`${proto}://${location.host}/buzzer/ws`);
+    const buzzer_ws = new WebSocket(`${proto}://${location.host}/buzzer/ws?format=${FORMAT}${roster.resumeParams()}`);
+    buzzer_ws.binaryType = "arraybuffer";
+    buzzer_ws.onopen = () => { retries = 0 }
 
     send = (event, data = {}) => (buzzer_ws.send(JSON.stringify({ "event": event, ...data })))
+    sendFrame = (data) => (buzzer_ws.send(data))
 
     buzzer_ws.onclose = (e) => {
         if (e.code == 1000) {
@@ -26,51 +39,65 @@ function connectWs() {
         else if (e.code == 403) {
             window.location.replace('/buzzer?error=1')
         }
+        else if (e.code == 4013) {
+            // The server is letting everyone back in gradually.
+            setTimeout(connectWs, Number(e.reason.split("=")[1]) || 1000);
+        }
         else {
-            console.log(e.code, "reconnecting...")
-            connectWs();
+            // Back off with jitter so a whole party doesn't reconnect at once.
+            const delay = Math.min(10000, 250 * 2 ** retries++) * (0.5 + Math.random());
+            console.log(e.code, `reconnecting in ${Math.round(delay)}ms...`)
+            setTimeout(connectWs, delay);
         }
     }
 
 
     buzzer_ws.onmessage = (e) => {
-        const msg = JSON.parse(e.data)
+        const msg = decodeMessage(e.data)
 
         switch (msg.event) {
             case "UPDATE":
-                updateBuzzers(msg.users);
-                updateButtonStyle(msg.button_state);
+                roster.load(msg);
+                updateState(msg);
+                break;
 
-                if (msg.sound)
-                    buzzSound()
+            case "DELTA":
+                if (!roster.apply(msg))
+                    send("RESYNC");
+                updateState(msg);
+                break;
 
-                if (msg.choice) {
-                    console.log(msg.choice)
-                    console.log(typeof msg.choice)
-                    document.getElementById("selfChoice").innerText = `Your Choice: ${msg.choice}`
-                } else {
-                    document.getElementById("selfChoice").innerText = ""
-                }
+            case "MULTIPLE_CHOICE":
+                document.getElementById("mcResults").innerHTML = "";
+                promptMultipleChoice(msg.choices)
+                break;
 
-                if (!msg.choices) {
-                    document.getElementById("selfChoice").innerText = "";
-                    break;
-                }
+            case "BUZZ_ACK":
+                // Our own buzz made it, ahead of the roster update.
+                buzz_position = msg.position;
+                updateButtonStyle("BUZZED");
+                break;
 
-                if (msg.choice)
-                    break
+            case "LOCK":
+                if (buzzer_state == "OPEN")
+                    updateButtonStyle("LOCKED");
+                break;
 
-            case "MULTIPLE_CHOICE":
-                promptMultipleChoice(msg.choices)
+            case "MC_ACK":
+                document.getElementById("selfChoice").innerText = `Your Choice: ${msg.choice}`
+                break;
+
+            case "MC_RESULTS":
+                renderResults(document.getElementById("mcResults"), msg);
                 break;
 
             case "RESET":
-                updateBuzzers([]);
+                rosterList.update(new Roster());
                 updateButtonStyle("OPEN")
                 break;
 
             case "PING":
-                send("PONG", { "id": msg.id })
+                sendFrame(encodePong(Number(msg.id), performance.now() / 1000))
                 break;
 
             case "END_MULTIPLE_CHOICE":
@@ -84,12 +111,28 @@ function connectWs() {
 
 connectWs()
 
-function buzzSound() {
-    if (audioToggle.checked) {
-        const audio = new Audio("/static/buzz.wav")
-        audio.volume = 0.2;
-        audio.play();
+function updateState(msg) {
+    rosterList.update(roster);
+    updateButtonStyle(msg.button_state);
+
+    if (msg.sound)
+        buzzSound()
+
+    if (msg.choice) {
+        document.getElementById("selfChoice").innerText = `Your Choice: ${msg.choice}`
+    } else {
+        document.getElementById("selfChoice").innerText = ""
     }
+
+    if (!msg.choices)
+        return;
+
+    if (!msg.choice)
+        promptMultipleChoice(msg.choices)
+}
+
+function buzzSound() {
+    if (audioToggle.checked) buzzerSound.play()
 }
 
 
@@ -123,6 +166,7 @@ function updateButtonStyle(newState) {
 
     switch (buzzer_state) {
         case "OPEN":
+            buzz_position = null;
             buzzer_button.style.borderColor = "green";
             buzzer_button.style.backgroundColor = "lightgreen";
             buzzer_button.innerHTML = "BUZZ";
@@ -131,7 +175,7 @@ function updateButtonStyle(newState) {
         case "BUZZED":
             buzzer_button.style.borderColor = "red";
             buzzer_button.style.backgroundColor = "lightcoral";
-            buzzer_button.innerHTML = "BUZZED";
+            buzzer_button.innerHTML = buzz_position === null ? "BUZZED" : `BUZZED #${buzz_position + 1}`;
             break;
         case "LOCKED":
             buzzer_button.style.borderColor = "yellow";
@@ -147,25 +191,13 @@ function updateButtonStyle(newState) {
 }
 
 
-function updateBuzzers(users) {
-    const list = document.getElementById("buzzed-users")
-    list.innerHTML = "";
-
-    if (users.length != 0) {
-        for (const user of users) {
-            const li = document.createElement("li");
-            li.classList.add(user.buzzed ? "buzzed" : "unbuzzed")
-            li.innerHTML = `
-                <div class="username">
-                    <img class="avatar" src="${user.avatar}?size=32"/>
-                    <span class="displayname">${user.name}${user.choice ? " (" + user.choice + ")" : ""}</span>
-                </div>`
-            list.appendChild(li);
-        }
-    }
-    else {
-        list.innerHTML = "<p>No users have buzzed...</p>"
-    }
+function renderRow(user, profile) {
+    return `
+        <div class="username">
+            <img class="avatar" src="${profile.avatar}?size=32"/>
+            <span class="displayname">${profile.name}${user.choice ? " (" + user.choice + ")" : ""}</span>
+            ${renderScore(user)}
+        </div>`
 }
 
 document.getElementById("leave").onclick = () => {
@@ -176,7 +208,7 @@ document.getElementById("leave").onclick = () => {
 
 document.body.addEventListener("keydown", function (e) {
     if (e.key == ' ') {
-        buzzer_button.onclick()
+        buzzer_button.onclick(e)
     }
 });
 
@@ -194,9 +226,11 @@ document.addEventListener('click', async (e) => {
     }
 });
 
-buzzer_button.onclick = () => {
+buzzer_button.onclick = (e) => {
     if (buzzer_state == "OPEN") {
-        send("BUZZ")
+        // Event timestamps share the performance.now() clock used for the
+        // PONGs, so the server can tell when the button was actually pressed.
+        sendFrame(encodeBuzz((e ? e.timeStamp : performance.now()) / 1000))
         updateButtonStyle("BUZZED")
     }
 }
\ No newline at end of file
@@ -1,8 +1,15 @@
+import { Roster, RosterList, renderResults, renderScore } from "./roster.js";
+import { FORMAT, decodeMessage } from "./wire.js";
+import { Sound } from "./sound.js";
+
 const proto = location.protocol === "https:" ? "wss" : "ws";
-const host_ws = new WebSocket(`${proto}://${location.host}/host/ws`);
+const host_ws = new WebSocket(`${proto}://${location.host}/host/ws?format=${FORMAT}`);
+host_ws.binaryType = "arraybuffer";
 
 const message_box = document.getElementById("message");
 var locked = false;
+const roster = new Roster();
+const rosterList = new RosterList(document.getElementById("buzzed-users"), renderRow);
 
 host_ws.onclose = (e) => {
     if (e.code == 1000) {
@@ -17,28 +24,54 @@ host_ws.onclose = (e) => {
 
 }
 
+// The page is the same for every party, the link is filled in here.
+document.getElementById("export").href = `${location.pathname}/export`
+
 document.getElementById("reset").onclick = () => { send("RESET") }
 document.getElementById("toggle-lock").onclick = () => {
     locked = !locked;
     updatebtn(locked)
-    send("TOGGLE_LOCK")
+    // An explicit state, so sending it twice does no harm.
+    send("SET_LOCK", { "locked": locked })
 }
 
 
+const lockAfter = document.getElementById("lockAfter")
+lockAfter.onchange = () => {
+    send("SET_LOCK_AFTER", { "count": Math.max(0, parseInt(lockAfter.value) || 0) })
+}
+
 const send = (event, data = {}) => (host_ws.send(JSON.stringify({ "event": event, ...data })))
 
 host_ws.onmessage = (e) => {
-    const msg = JSON.parse(e.data)
+    const msg = decodeMessage(e.data)
 
     switch (msg.event) {
         case "UPDATE":
-            updateBuzzers(msg.users);
-            updatebtn(msg.button_state == "LOCKED")
-            if (msg.sound) buzz()
+            roster.load(msg)
+            updateState(msg)
+            break;
+        case "DELTA":
+            if (!roster.apply(msg)) send("RESYNC")
+            updateState(msg)
+            break;
+        case "MC_RESULTS":
+            roster.setChoices(msg.answers)
+            rosterList.update(roster)
+            renderResults(document.getElementById("mcResults"), msg)
+            updateChoices(msg.choices)
             break;
     }
 }
 
+function updateState(msg) {
+    rosterList.update(roster);
+    updatebtn(msg.button_state == "LOCKED")
+    if (msg.lock_after !== undefined && document.activeElement !== lockAfter)
+        lockAfter.value = msg.lock_after
+    if (msg.sound) buzz()
+}
+
 function updatebtn(state) {
     locked = state;
     const button = document.querySelector(".admin-buttons")
@@ -54,35 +87,47 @@ function updatebtn(state) {
 
 
 
-function updateBuzzers(users) {
-    const list = document.getElementById("buzzed-users")
-    list.innerHTML = "";
+function renderRow(user, profile) {
+    return `
+        <div class="username${user.connected ? '' : ' connLost'}">
+            <img class="avatar" src="${profile.avatar}?size=32"/>
+            <span class="displayname">${profile.name} ${user.choice ? " (" + user.choice + ")" : ""}</span>
+            ${user.buzzed && user.margin != null ? `<span class="margin">±${user.margin}ms</span>` : ""}
+            ${renderScore(user)}
+            <button class="award" data-id="${user.id}" data-sign="1">+</button>
+            <button class="award" data-id="${user.id}" data-sign="-1">-</button>
+        </div>`
+}
 
-    if (users.length != 0) {
-        for (const user of users) {
-            const li = document.createElement("li");
-            li.classList.add(user.buzzed ? "buzzed" : "unbuzzed")
-            li.innerHTML = `
-                <div class="username${user.connected ? '' : ' connLost'}">
-                    <img class="avatar" src="${user.avatar}?size=32"/>
-                    <span class="displayname">${user.name} ${user.choice ? " (" + user.choice + ")" : ""}</span>
-                </div>`
-            list.appendChild(li);
-        }
-    }
-    else {
-        list.innerHTML = "<p>No users have buzzed...</p>"
+const awardPoints = document.getElementById("awardPoints")
+const points = () => Math.max(0, parseInt(awardPoints.value) || 0)
+
+document.getElementById("buzzed-users").onclick = (e) => {
+    const button = e.target.closest("button.award")
+    if (!button) return
+    send("AWARD", { "id": parseInt(button.dataset.id), "points": points() * parseInt(button.dataset.sign) })
+}
+
+const correctChoice = document.getElementById("correctChoice")
+
+function updateChoices(choices) {
+    const options = choices.map((choice) => `<option>${choice}</option>`).join("")
+    if (correctChoice.dataset.options !== options) {
+        correctChoice.innerHTML = options
+        correctChoice.dataset.options = options
     }
 }
 
+document.getElementById("markCorrect").onclick = (e) => {
+    e.preventDefault()
+    if (correctChoice.value) send("MARK_CORRECT", { "choice": correctChoice.value, "points": points() })
+}
+
 const audioToggle = document.getElementById("audio")
+const buzzerSound = new Sound("/static/buzz.wav", 0.2)
 
 function buzz() {
-    if (audioToggle.checked) {
-        const audio = new Audio("/static/buzz.wav")
-        audio.volume = 0.2;
-        audio.play();
-    }
+    if (audioToggle.checked) buzzerSound.play()
 }
 
 function auto_grow(element) {
@@ -100,6 +145,7 @@ document.getElementById("promptForm").onsubmit = (e) => {
 
 document.getElementById("clearChoices").onclick = (e) => {
     e.preventDefault()
+    document.getElementById("mcResults").innerHTML = ""
     send("CLEAR_MC")
 }
 
@@ -0,0 +1,168 @@
+// Client side copy of the party roster, kept in sync through the UPDATE
+// snapshots and the sequence numbered DELTA events sent by the server.
+export class Roster {
+    constructor() {
+        this.users = new Map();
+        this.profiles = new Map();
+        this.order = [];
+        this.seq = null;
+        this.epoch = null;
+    }
+
+    // Query parameters asking the server to only send what was missed.
+    resumeParams() {
+        if (this.seq === null || !this.epoch)
+            return "";
+        return `&epoch=${encodeURIComponent(this.epoch)}&seq=${this.seq}`;
+    }
+
+    load(msg) {
+        for (const profile of msg.profiles)
+            this.profiles.set(profile.id, profile);
+        this.users = new Map(msg.users.map((user) => [user.id, user]));
+        this.order = msg.users.filter((user) => user.buzzed).map((user) => user.id);
+        this.seq = msg.seq;
+        if (msg.epoch) this.epoch = msg.epoch;
+    }
+
+    // Returns false when a delta was missed and a resync is needed.
+    apply(msg) {
+        if (this.seq === null || msg.seq <= this.seq)
+            return true;
+        if (msg.seq != this.seq + 1) {
+            this.seq = null;
+            return false;
+        }
+
+        for (const op of msg.ops) {
+            const user = this.users.get(op.id);
+            switch (op.op) {
+                case "profile":
+                    this.profiles.set(op.id, { id: op.id, name: op.name, avatar: op.avatar });
+                    break;
+                case "join":
+                    this.users.set(op.user.id, op.user);
+                    this.unbuzz(op.user.id);
+                    if (op.user.buzzed)
+                        this.order.splice(op.position, 0, op.user.id);
+                    break;
+                case "leave":
+                    this.users.delete(op.id);
+                    this.unbuzz(op.id);
+                    break;
+                case "connected":
+                    if (user) user.connected = op.connected;
+                    break;
+                case "buzz":
+                    if (!user) break;
+                    user.buzzed = true;
+                    user.margin = op.margin;
+                    this.unbuzz(op.id);
+                    this.order.splice(op.position, 0, op.id);
+                    break;
+                case "choice":
+                    if (user) user.choice = op.choice;
+                    break;
+                case "score":
+                    if (user) user.points = op.points;
+                // fallthrough, a score op carries the rank too
+                case "rank":
+                    if (user) user.rank = op.rank;
+                    break;
+                case "reset":
+                    this.order = [];
+                    for (const u of this.users.values()) {
+                        u.buzzed = false;
+                        u.margin = null;
+                    }
+                    break;
+            }
+        }
+        this.seq = msg.seq;
+        return true;
+    }
+
+    // Answers the host learns about through MC_RESULTS, outside of the deltas.
+    setChoices(answers) {
+        for (const [id, choice] of answers) {
+            const user = this.users.get(id);
+            if (user) user.choice = choice;
+        }
+    }
+
+    unbuzz(id) {
+        const position = this.order.indexOf(id);
+        if (position != -1)
+            this.order.splice(position, 1);
+    }
+
+    list() {
+        const waiting = [...this.users.values()]
+            .filter((user) => !user.buzzed)
+            .sort((a, b) => a.id - b.id);
+        return [...this.order.map((id) => this.users.get(id)), ...waiting];
+    }
+}
+
+// Keeps one <li> per user around and only touches the rows that changed,
+// instead of rebuilding the whole list on every update.
+export class RosterList {
+    constructor(element, renderRow) {
+        this.element = element;
+        this.renderRow = renderRow;
+        this.rows = new Map();
+    }
+
+    update(roster) {
+        const users = roster.list();
+        if (users.length == 0) {
+            this.rows.clear();
+            this.element.innerHTML = "<p>No users have buzzed...</p>";
+            return;
+        }
+
+        const seen = new Set();
+        users.forEach((user, position) => {
+            seen.add(user.id);
+            let row = this.rows.get(user.id);
+            if (!row) {
+                row = { li: document.createElement("li"), html: null };
+                this.rows.set(user.id, row);
+            }
+
+            const html = this.renderRow(user, roster.profiles.get(user.id) || {});
+            if (row.html !== html) {
+                row.li.innerHTML = html;
+                row.html = html;
+            }
+            row.li.className = user.buzzed ? "buzzed" : "unbuzzed";
+
+            const current = this.element.children[position];
+            if (current !== row.li)
+                this.element.insertBefore(row.li, current || null);
+        });
+
+        for (const [id, row] of this.rows) {
+            if (!seen.has(id)) {
+                row.li.remove();
+                this.rows.delete(id);
+            }
+        }
+        while (this.element.children.length > users.length)
+            this.element.lastElementChild.remove();
+    }
+}
+
+// Rank and points, once the player has any.
+export function renderScore(user) {
+    return user.points ? `<span class="score">#${user.rank} ${user.points}pts</span>` : "";
+}
+
+export function renderResults(element, msg) {
+    const total = msg.counts.reduce((a, b) => a + b, 0) || 1;
+    element.innerHTML = msg.choices.map((choice, i) => `
+        <div class="result">
+            <span>${choice}: ${msg.counts[i]}</span>
+            <div class="resultBar" style="width: ${Math.round(100 * msg.counts[i] / total)}%"></div>
+        </div>`).join("") + `<p>${msg.answered}/${msg.players} answered</p>`;
+}
@@ -0,0 +1,29 @@
+// A short sound, fetched and decoded once and then played from memory, so a
+// buzz doesn't create a new <audio> element and request the file again.
+export class Sound {
+    constructor(url, volume) {
+        this.url = url;
+        this.context = new AudioContext();
+        this.gain = this.context.createGain();
+        this.gain.gain.value = volume;
+        this.gain.connect(this.context.destination);
+        this.buffer = fetch(url)
+            .then((response) => response.arrayBuffer())
+            .then((data) => this.context.decodeAudioData(data))
+            .catch(() => null);
+
+        // Browsers only let the page make noise after the user did something.
+        const unlock = () => this.context.resume();
+        document.addEventListener("pointerdown", unlock, { once: true });
+        document.addEventListener("keydown", unlock, { once: true });
+    }
+
+    async play() {
+        const buffer = await this.buffer;
+        if (!buffer) return;
+        const source = this.context.createBufferSource();
+        source.buffer = buffer;
+        source.connect(this.gain);
+        source.start();
+    }
+}
@@ -0,0 +1,53 @@
+import { RosterList, renderResults, renderScore } from "./roster.js";
+
+const list = document.getElementById("buzzed-users");
+const message_box = document.getElementById("message");
+const rosterList = new RosterList(list, renderRow);
+var retries = 0;
+
+function connectWs() {
+    const proto = location.protocol === "https:" ? "wss" : "ws";
+    const params = new URLSearchParams(location.search);
+    const fps = params.has("fps") ? `?fps=${params.get("fps")}` : "";
+    const watch_ws = new WebSocket(`${proto}://${location.host}/watch/${location.pathname.split("/")[2]}/ws${fps}`);
+
+    watch_ws.onopen = () => { retries = 0 }
+    watch_ws.onmessage = (e) => updateState(JSON.parse(e.data))
+    watch_ws.onclose = (e) => {
+        if (e.code == 1000) {
+            message_box.innerHTML = `<p>${e.reason || "The game has ended."}</p>`;
+            message_box.style.display = "inline-block";
+            return;
+        }
+        const delay = Math.min(10000, 250 * 2 ** retries++) * (0.5 + Math.random());
+        setTimeout(connectWs, delay);
+    }
+}
+
+connectWs()
+
+function updateState(msg) {
+    // Frames carry the whole state in order, so no Roster is needed here.
+    rosterList.update({
+        profiles: new Map(msg.users.map((user) => [user.id, user])),
+        list: () => msg.users,
+    });
+    document.getElementById("lockState").innerText = msg.locked ? "LOCKED" : "";
+
+    const results = document.getElementById("mcResults");
+    if (msg.results) {
+        const answered = msg.results.counts.reduce((a, b) => a + b, 0);
+        renderResults(results, { ...msg.results, answered: answered, players: msg.users.length });
+    } else {
+        results.innerHTML = "";
+    }
+}
+
+function renderRow(user, profile) {
+    return `
+        <div class="username${user.connected ? '' : ' connLost'}">
+            <img class="avatar" src="${profile.avatar}?size=32"/>
+            <span class="displayname">${profile.name}${user.choice ? " (" + user.choice + ")" : ""}</span>
+            ${renderScore(user)}
+        </div>`
+}
@@ -0,0 +1,120 @@
+// Compact binary wire format, see modules/wire.py. Connecting with
+// ?format=binary makes the server send MessagePack, plus fixed layouts for
+// PING/PONG/BUZZ/BUZZ_ACK/LOCK. Anything sent as text is still JSON.
+// Opening a page with ?format=json, or a browser without TextDecoder, keeps
+// the whole connection on JSON.
+export const FORMAT =
+    new URLSearchParams(location.search).get("format") === "json" || typeof TextDecoder === "undefined"
+        ? "json"
+        : "binary";
+
+const PING = 0x01;
+const PONG = 0x02;
+const BUZZ = 0x03;
+const BUZZ_ACK = 0x04;
+const LOCK = 0x05;
+
+export function decodeMessage(data) {
+    if (typeof data === "string")
+        return JSON.parse(data);
+
+    const view = new DataView(data);
+    if (view.getUint8(0) == PING)
+        return { "event": "PING", "id": view.getUint32(1) };
+    if (view.getUint8(0) == BUZZ_ACK)
+        return { "event": "BUZZ_ACK", "t": view.getFloat64(1), "position": view.getUint16(9) };
+    if (view.getUint8(0) == LOCK)
+        return { "event": "LOCK" };
+    return new Decoder(view).read();
+}
+
+export function encodePong(id, t) {
+    if (FORMAT === "json")
+        return JSON.stringify({ "event": "PONG", "id": String(id), "t": t });
+    const view = new DataView(new ArrayBuffer(13));
+    view.setUint8(0, PONG);
+    view.setUint32(1, id);
+    view.setFloat64(5, t);
+    return view.buffer;
+}
+
+export function encodeBuzz(t) {
+    if (FORMAT === "json")
+        return JSON.stringify({ "event": "BUZZ", "t": t });
+    const view = new DataView(new ArrayBuffer(9));
+    view.setUint8(0, BUZZ);
+    view.setFloat64(1, t);
+    return view.buffer;
+}
+
+const textDecoder = FORMAT === "binary" ? new TextDecoder() : null;
+
+// Just enough of a MessagePack decoder for what the server sends.
+class Decoder {
+    constructor(view) {
+        this.view = view;
+        this.pos = 0;
+    }
+
+    take(size) {
+        const pos = this.pos;
+        this.pos += size;
+        return pos;
+    }
+
+    str(size) {
+        const pos = this.take(size);
+        return textDecoder.decode(new Uint8Array(this.view.buffer, this.view.byteOffset + pos, size));
+    }
+
+    array(size) {
+        const out = new Array(size);
+        for (let i = 0; i < size; i++)
+            out[i] = this.read();
+        return out;
+    }
+
+    map(size) {
+        const out = {};
+        for (let i = 0; i < size; i++) {
+            const key = this.read();
+            out[key] = this.read();
+        }
+        return out;
+    }
+
+    read() {
+        const view = this.view;
+        const type = view.getUint8(this.take(1));
+
+        if (type <= 0x7f) return type;
+        if (type >= 0xe0) return type - 0x100;
+        if (type <= 0x8f) return this.map(type & 0x0f);
+        if (type <= 0x9f) return this.array(type & 0x0f);
+        if (type <= 0xbf) return this.str(type & 0x1f);
+
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xca: return view.getFloat32(this.take(4));
+            case 0xcb: return view.getFloat64(this.take(8));
+            case 0xcc: return view.getUint8(this.take(1));
+            case 0xcd: return view.getUint16(this.take(2));
+            case 0xce: return view.getUint32(this.take(4));
+            case 0xcf: return Number(view.getBigUint64(this.take(8)));
+            case 0xd0: return view.getInt8(this.take(1));
+            case 0xd1: return view.getInt16(this.take(2));
+            case 0xd2: return view.getInt32(this.take(4));
+            case 0xd3: return Number(view.getBigInt64(this.take(8)));
+            case 0xd9: return this.str(view.getUint8(this.take(1)));
+            case 0xda: return this.str(view.getUint16(this.take(2)));
+            case 0xdb: return this.str(view.getUint32(this.take(4)));
+            case 0xdc: return this.array(view.getUint16(this.take(2)));
+            case 0xdd: return this.array(view.getUint32(this.take(4)));
+            case 0xde: return this.map(view.getUint16(this.take(2)));
+            case 0xdf: return this.map(view.getUint32(this.take(4)));
+        }
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+}